@@ -1,7 +1,50 @@
 import hashlib
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+TZ = ZoneInfo("Europe/Ljubljana")  # Wise times are naive local times
+
+
+def to_epoch(value) -> int | None:
+    """ISO string, datetime (naive = Europe/Ljubljana) or epoch seconds → epoch seconds."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=TZ)
+    return int(value.timestamp())
 
 
 class CalendarEvent:
+    # Slotted: no per-instance __dict__, which matters at 100k+ events.
+    # The _hash/_summary/_description slots cache derived values on first use,
+    # so treat the content fields as read-only once any of them has been read.
+    __slots__ = (
+        "uid",
+        "course_id",
+        "course",
+        "execution_type",
+        "start_time",
+        "end_time",
+        "location",
+        "lecturers",
+        "groups",
+        "note",
+        "start_ts",
+        "end_ts",
+        "google_id",
+        "disabled",
+        "google_hash",
+        "google_etag",
+        "recurrence",
+        "_hash",
+        "_summary",
+        "_description",
+    )
+
     def __init__(
         self,
         uid,
@@ -14,8 +57,13 @@ class CalendarEvent:
         lecturers,
         groups,
         note="",
+        start_ts=None,
+        end_ts=None,
         google_id=None,
         disabled=False,
+        google_hash=None,
+        google_etag=None,
+        recurrence=None,
     ):
         self.uid = uid
         self.course_id = course_id
@@ -27,38 +75,64 @@ class CalendarEvent:
         self.lecturers = lecturers     # lecturer names joined by ", "
         self.groups = groups           # group names joined by ", "
         self.note = note
+        # Epoch seconds, parsed once at ingest (parse.entry_fields) or read from the DB
+        self.start_ts = to_epoch(start_time) if start_ts is None else start_ts
+        self.end_ts = to_epoch(end_time) if end_ts is None else end_ts
         self.google_id = google_id
         self.disabled = disabled
+        self.google_hash = google_hash  # hash of the body last pushed to Google
+        self.google_etag = google_etag  # etag of that push, for If-Match
+        self.recurrence = recurrence    # RRULE/EXDATE lines joined by "\n" for a collapsed series (see series.py)
+        self._hash = None
+        self._summary = None
+        self._description = None
 
     @property
     def hash(self):
         """Stable hash of all fields that matter for change detection."""
-        raw = "|".join([
-            self.course or "",
-            self.execution_type or "",
-            self.start_time or "",
-            self.end_time or "",
-            self.location or "",
-            self.lecturers or "",
-            self.groups or "",
-            self.note or "",
-        ])
-        return hashlib.sha256(raw.encode()).hexdigest()
+        if self._hash is None:
+            raw = "|".join([
+                self.course or "",
+                self.execution_type or "",
+                self.start_time or "",
+                self.end_time or "",
+                self.location or "",
+                self.lecturers or "",
+                self.groups or "",
+                self.note or "",
+            ])
+            if self.recurrence:
+                raw += "|" + self.recurrence
+            self._hash = hashlib.sha256(raw.encode()).hexdigest()
+        return self._hash
+
+    @property
+    def start(self) -> datetime:
+        """Aware start time in Europe/Ljubljana."""
+        return datetime.fromtimestamp(self.start_ts, TZ)
+
+    @property
+    def end(self) -> datetime:
+        return datetime.fromtimestamp(self.end_ts, TZ)
 
     @property
     def summary(self):
-        return f"{self.course} [{self.execution_type}]"
+        if self._summary is None:
+            self._summary = f"{self.course} [{self.execution_type}]"
+        return self._summary
 
     @property
     def description(self):
-        parts = []
-        if self.lecturers:
-            parts.append(f"Lecturer: {self.lecturers}")
-        if self.groups:
-            parts.append(f"Group: {self.groups}")
-        if self.note:
-            parts.append(f"Note: {self.note}")
-        return "\n".join(parts)
+        if self._description is None:
+            parts = []
+            if self.lecturers:
+                parts.append(f"Lecturer: {self.lecturers}")
+            if self.groups:
+                parts.append(f"Group: {self.groups}")
+            if self.note:
+                parts.append(f"Note: {self.note}")
+            self._description = "\n".join(parts)
+        return self._description
 
     def __repr__(self):
         return f"<CalendarEvent {self.uid} {self.course} {self.start_time}>"
@@ -0,0 +1,657 @@
+"""
+Offline benchmarks. Usage:
+    python bench.py <name> [args...]
+Run without arguments to list the available benchmarks.
+"""
+import os
+import sys
+import time
+import logging
+import tempfile
+
+import db
+from CalendarEvent import CalendarEvent
+
+BENCHMARKS = {}
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__.removeprefix("bench_")] = fn
+    return fn
+
+
+def synthetic_events(n: int, course_id: str = "9999") -> list[CalendarEvent]:
+    """Generate n distinct events spread over a semester of weekday slots."""
+    events = []
+    for i in range(n):
+        day = 1 + (i // 8) % 28
+        hour = 8 + i % 8
+        start = f"2026-03-{day:02d}T{hour:02d}:00:00"
+        end = f"2026-03-{day:02d}T{hour + 1:02d}:00:00"
+        events.append(CalendarEvent(
+            uid=f"B{i}_{start}",
+            course_id=course_id,
+            course=f"BENCH COURSE {i % 50}",
+            execution_type="PR",
+            start_time=start,
+            end_time=end,
+            location="A-301",
+            lecturers="BENCH LECTURER",
+            groups="R-IT 3 UN - UP IPVB UP3",
+        ))
+    return events
+
+
+def _fresh_db(tmpdir: str, name: str = "bench.db"):
+    db.DB_PATH = os.path.join(tmpdir, name)
+    db.init_db()
+
+
+@benchmark
+def bench_google_sync(n: str = "2000", latency: str = "0.002", workers: str = "4"):
+    """Push n new events to a fake Calendar: serial calls vs batched vs batched on a pool."""
+    import executor
+    import sync_google
+    from fake_calendar import FakeCalendarService
+
+    n, latency, workers = int(n), float(latency), int(workers)
+    runs = (
+        ("serial", 1, 1),
+        ("batched", executor.BATCH_SIZE, 1),
+        (f"batched x{workers}", executor.BATCH_SIZE, workers),
+    )
+    for label, batch_size, pool in runs:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            _fresh_db(tmpdir)
+            db.sync_events(synthetic_events(n))
+            service = FakeCalendarService(latency=latency)
+
+            executor.BATCH_SIZE, saved = batch_size, executor.BATCH_SIZE
+            t0 = time.perf_counter()
+            # Unlimited rate: measure the client, not the quota
+            sync_google.sync_to_google("bench", service=service, workers=pool, rate=1e9)
+            elapsed = time.perf_counter() - t0
+            executor.BATCH_SIZE = saved
+
+            print(f"{label:12s} {n} events: {elapsed:.2f}s, {service.round_trips} round trips, "
+                  f"{n / elapsed:.0f} events/s")
+
+
+@benchmark
+def bench_sink(
+    n: str = "10000",
+    latency: str = "0.005",
+    errors: str = "0.01",
+    workers: str = "4",
+    store: str = "memory",
+):
+    """
+    Replay synthetic diffs (create n, update n/10, delete n/10) into a GoogleSink
+    backed by the fake Calendar with injected 403/429/404s (`errors` each); report
+    throughput and p50/p99 per operation. store=sqlite keeps the fake on disk.
+    """
+    import executor
+    from fake_calendar import FakeCalendarService
+    from sinks import GoogleSink
+
+    n, latency, error_rate, workers = int(n), float(latency), float(errors), int(workers)
+    saved_backoff, executor.BACKOFF_BASE = executor.BACKOFF_BASE, 0.01  # measure the client, not the sleep
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            _fresh_db(tmpdir)
+            service = FakeCalendarService(
+                latency=latency, jitter=latency, seed=1,
+                error_rates={403: error_rate, 429: error_rate, 404: error_rate},
+                db_path=os.path.join(tmpdir, "fake.db") if store == "sqlite" else None,
+            )
+            sink = GoogleSink("bench", service=service, workers=workers, rate=1e9)
+            events = synthetic_events(n)
+            changed = n // 10
+
+            def _replay(label, fresh):
+                calls = service.calls
+                t0 = time.perf_counter()
+                created, updated, disabled = db.sync_events(fresh)
+                sink.push(created, updated)
+                elapsed = time.perf_counter() - t0
+                ops = len(created) + len(updated) + disabled
+                print(f"{label:8s} {ops:7d} ops in {elapsed:6.2f}s  {ops / elapsed:8.0f} ops/s  "
+                      f"{service.calls - calls} API calls")
+
+            _replay("create", events)
+            for event in events[:changed]:
+                event.location = "B-100"
+                event._hash = None
+            _replay("update", events)
+            _replay("delete", events[changed:])
+
+            print(f"injected errors: {dict(sorted(service.injected.items()))}, "
+                  f"{service.count('bench')} events in the fake calendar")
+            for op, (p50, p99) in sorted(service.latency_percentiles(50, 99).items()):
+                print(f"{op:8s} p50 {p50 * 1000:7.1f} ms  p99 {p99 * 1000:7.1f} ms  ({len(service.timings[op])} requests)")
+    finally:
+        executor.BACKOFF_BASE = saved_backoff
+
+
+def _legacy_sync_events(path: str, fresh_events: list[CalendarEvent]):
+    """The original db.sync_events: fresh connection, one statement per row."""
+    import sqlite3
+    conn = sqlite3.connect(path)
+    db_map = {row[0]: row[1] for row in conn.execute("SELECT uid, hash FROM events")}
+    fresh_uids = {e.uid for e in fresh_events}
+    for event in fresh_events:
+        existing = db_map.get(event.uid)
+        if existing is None:
+            conn.execute("""
+                INSERT INTO events
+                    (uid, course_id, course, execution_type, start_time, end_time,
+                     location, lecturers, groups, note, hash, google_id, disabled)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, 0)
+            """, (
+                event.uid, event.course_id, event.course, event.execution_type,
+                event.start_time, event.end_time, event.location, event.lecturers,
+                event.groups, event.note, event.hash,
+            ))
+            logging.info(f"[CREATE] {event.uid} — {event.course} {event.start_time}")
+        elif existing != event.hash:
+            conn.execute("""
+                UPDATE events SET
+                    course_id = ?, course = ?, execution_type = ?,
+                    start_time = ?, end_time = ?, location = ?,
+                    lecturers = ?, groups = ?, note = ?, hash = ?, disabled = 0
+                WHERE uid = ?
+            """, (
+                event.course_id, event.course, event.execution_type,
+                event.start_time, event.end_time, event.location,
+                event.lecturers, event.groups, event.note, event.hash, event.uid,
+            ))
+            logging.info(f"[UPDATE] {event.uid} — {event.course} {event.start_time}")
+        else:
+            logging.debug(f"[UNCHANGED] {event.uid}")
+    for uid in set(db_map) - fresh_uids:
+        conn.execute("UPDATE events SET disabled = 1 WHERE uid = ?", (uid,))
+    conn.commit()
+    conn.close()
+
+
+def _legacy_update_google_ids(path: str, rows: list[tuple]):
+    """The original db.update_google_id: connect + commit per event."""
+    import sqlite3
+    for uid, google_id, _, _ in rows:
+        conn = sqlite3.connect(path)
+        conn.execute("UPDATE events SET google_id = ? WHERE uid = ?", (google_id, uid))
+        conn.commit()
+        conn.close()
+
+
+@benchmark
+def bench_db(n: str = "100000", writes: str = "5000"):
+    """sync_events + google_id writes on a synthetic n-event table: per-call connections vs shared WAL connection."""
+    n, writes = int(n), int(writes)
+    events = synthetic_events(n)
+    changed = synthetic_events(n)
+    for e in changed[::100]:
+        e.location = "B-1"
+    gid_rows = [(e.uid, f"g{i}", None, None) for i, e in enumerate(events[:writes])]
+
+    def _legacy(path):
+        _legacy_sync_events(path, events)
+        yield "initial load"
+        _legacy_sync_events(path, changed)
+        yield "resync, 1% changed"
+        _legacy_update_google_ids(path, gid_rows)
+        yield f"{writes} google_id writes"
+
+    def _current(path):
+        db.sync_events(events)
+        yield "initial load"
+        db.sync_events(changed)
+        yield "resync, 1% changed"
+        db.update_google_ids(gid_rows)
+        yield f"{writes} google_id writes"
+
+    for label, steps in (("legacy", _legacy), ("current", _current)):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            _fresh_db(tmpdir)
+            if label == "legacy":
+                # The legacy path expects a rollback-journal DB with its own connections
+                db.get_conn().execute("PRAGMA journal_mode=DELETE")
+                db.close()
+            t0 = time.perf_counter()
+            for step in steps(db.DB_PATH):
+                t1 = time.perf_counter()
+                print(f"{label:8s} {step:28s} {t1 - t0:7.2f}s")
+                t0 = t1
+            db.close()
+
+
+def _loop_sync_chunk(conn, chunk: list[CalendarEvent], created: list, updated: list):
+    """The per-event diff sync_events used before the temp-table engine: dict lookups and one row per statement."""
+    fresh_map = {e.uid: e for e in chunk}
+    rows = conn.execute(f"""
+        SELECT uid, hash, google_id, google_hash, google_etag, disabled
+        FROM events WHERE uid IN ({", ".join("?" * len(fresh_map))})
+    """, list(fresh_map)).fetchall()
+    db_map = {row[0]: row[1:] for row in rows}
+    inserts, updates = [], []
+    for event in fresh_map.values():
+        existing = db_map.get(event.uid)
+        event_hash = event.hash
+        if existing is None:
+            inserts.append((
+                event.uid, event.course_id, event.course, event.execution_type, event.start_time, event.end_time,
+                event.location, event.lecturers, event.groups, event.note, event_hash,
+                event.start_ts, event.end_ts, event.recurrence,
+            ))
+            db.logger.info(f"[CREATE] {event.uid} — {event.course} {event.start_time}")
+            created.append(event)
+        elif existing[0] != event_hash or existing[4]:
+            updates.append((
+                event.course_id, event.course, event.execution_type, event.start_time, event.end_time,
+                event.location, event.lecturers, event.groups, event.note, event_hash,
+                event.start_ts, event.end_ts, event.recurrence, event.uid,
+            ))
+            event.google_id, event.google_hash, event.google_etag = existing[1:4]
+            db.logger.info(f"[UPDATE] {event.uid} — {event.course} {event.start_time}")
+            updated.append(event)
+    conn.executemany("""
+        INSERT INTO events
+            (uid, course_id, course, execution_type, start_time, end_time, location, lecturers, groups,
+             note, hash, start_ts, end_ts, recurrence, google_id, disabled)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, 0)
+    """, inserts)
+    conn.executemany("""
+        UPDATE events SET
+            course_id = ?, course = ?, execution_type = ?, start_time = ?, end_time = ?, location = ?,
+            lecturers = ?, groups = ?, note = ?, hash = ?, start_ts = ?, end_ts = ?, recurrence = ?, disabled = 0
+        WHERE uid = ?
+    """, updates)
+    db._enqueue(conn, [(row[0], "upsert") for row in inserts] + [(row[-1], "upsert") for row in updates])
+    conn.executemany("INSERT OR IGNORE INTO temp.seen_uids (uid) VALUES (?)", [(uid,) for uid in fresh_map])
+
+
+def _loop_sync_events(fresh_events: list[CalendarEvent]):
+    created, updated = [], []
+    with db.transaction() as conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen_uids (uid TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.seen_uids")
+        for i in range(0, len(fresh_events), db.SYNC_CHUNK_SIZE):
+            _loop_sync_chunk(conn, fresh_events[i:i + db.SYNC_CHUNK_SIZE], created, updated)
+        removed = [row[0] for row in conn.execute(
+            "SELECT uid FROM events WHERE disabled = 0 AND uid NOT IN (SELECT uid FROM temp.seen_uids)"
+        )]
+        for uid in removed:
+            db.logger.info(f"[DISABLED] {uid} — no longer in API response")
+        conn.executemany("UPDATE events SET disabled = 1 WHERE uid = ?", [(uid,) for uid in removed])
+        db._enqueue(conn, [(uid, "delete") for uid in removed])
+        conn.execute("DELETE FROM temp.seen_uids")
+    return created, updated, len(removed)
+
+
+_ROW_COLUMNS = (
+    "course_id, course, execution_type, start_time, end_time, location, lecturers, "
+    "groups, note, hash, start_ts, end_ts, recurrence, last_end_ts, uid"
+)  # db._event_fields order
+
+
+def _full_set_sync_chunk(conn, chunk: list[CalendarEvent], created: list, updated: list):
+    """
+    db._sync_chunk with the writes set-based too: every fresh row is bound into
+    temp.fresh_rows, then one UPDATE ... FROM and one INSERT ... SELECT apply
+    the changed and new ones, instead of binding full rows only for those.
+    """
+    fresh_map = {e.uid: e for e in chunk}
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS fresh_rows ({_ROW_COLUMNS})")
+    conn.execute("DELETE FROM temp.fresh_rows")
+    conn.executemany(
+        f"INSERT INTO temp.fresh_rows ({_ROW_COLUMNS}) VALUES ({', '.join('?' * 15)})",
+        [db._event_fields(e) for e in fresh_map.values()],
+    )
+    conn.execute("INSERT INTO temp.fresh_keys (uid, hash) SELECT uid, hash FROM temp.fresh_rows")
+    changes = conn.execute("""
+        SELECT f.uid, e.uid IS NULL, e.google_id, e.google_hash, e.google_etag
+        FROM temp.fresh_rows f LEFT JOIN events e ON e.uid = f.uid
+        WHERE e.uid IS NULL OR e.hash IS NOT f.hash OR e.disabled
+    """).fetchall()
+    if not changes:
+        return
+    for uid, is_new, google_id, google_hash, google_etag in changes:
+        event = fresh_map[uid]
+        if is_new:
+            created.append(event)
+        else:
+            event.google_id, event.google_hash, event.google_etag = google_id, google_hash, google_etag
+            updated.append(event)
+
+    assignments = ", ".join(f"{c} = f.{c}" for c in _ROW_COLUMNS.split(", ")[:-1])
+    conn.execute(f"""
+        UPDATE events SET {assignments}, disabled = 0
+        FROM temp.fresh_rows f
+        WHERE events.uid = f.uid AND (events.hash IS NOT f.hash OR events.disabled)
+    """)
+    conn.execute(f"""
+        INSERT INTO events ({_ROW_COLUMNS}, google_id, disabled)
+        SELECT {_ROW_COLUMNS}, NULL, 0 FROM temp.fresh_rows WHERE uid NOT IN (SELECT uid FROM events)
+    """)
+    db._enqueue(conn, [(uid, "upsert") for uid, *_ in changes])
+
+
+def _full_set_sync_events(fresh_events: list[CalendarEvent]):
+    original, db._sync_chunk = db._sync_chunk, _full_set_sync_chunk
+    try:
+        return db.sync_events(fresh_events)
+    finally:
+        db._sync_chunk = original
+
+
+@benchmark
+def bench_diff(sizes: str = "10000,100000,1000000"):
+    """
+    sync_events cycle time per table size: per-event loop vs set-based temp-table
+    diff ("set", binding full rows only for new and changed events) vs a fully
+    set-based variant ("set-all": every row bound, INSERT ... SELECT / UPDATE ... FROM).
+    """
+    for n in map(int, sizes.split(",")):
+        events = synthetic_events(n)
+        changed = synthetic_events(n)
+        for e in changed[::100]:
+            e.location = "B-1"
+        changed = changed[: n - n // 100]  # and the last 1% removed
+
+        for label, sync in (("loop", _loop_sync_events), ("set", db.sync_events), ("set-all", _full_set_sync_events)):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                _fresh_db(tmpdir)
+                times = []
+                for fresh in (events, events, changed):
+                    t0 = time.perf_counter()
+                    sync(fresh)
+                    times.append(time.perf_counter() - t0)
+                db.close()
+            print(f"{n:>8} {label:7s} initial load {times[0]:7.2f}s   unchanged {times[1]:7.2f}s   "
+                  f"1% changed + 1% removed {times[2]:7.2f}s")
+
+
+def write_schedule_dir(path: str, files: int, entries: int):
+    """Fill path with `files` Wise-style JSON files of `entries` entries each."""
+    import json
+    os.makedirs(path, exist_ok=True)
+    for f in range(files):
+        course_id = str(10000 + f)
+        data = []
+        for i in range(entries):
+            day = 1 + i % 28
+            hour = 8 + i % 10
+            data.append({
+                "id": f"S{f}_{i}",
+                "start_time": f"2026-03-{day:02d}T{hour:02d}:00:00",
+                "end_time": f"2026-03-{day:02d}T{hour + 1:02d}:00:00",
+                "courseId": course_id,
+                "course": f"BENCH COURSE {f}",
+                "eventType": "",
+                "note": "",
+                "executionTypeId": "2",
+                "executionType": ("PR", "SV", "RV")[i % 3],
+                "branches": [{"id": 110, "name": "BU20 UP3"}],
+                "rooms": [{"id": 17, "name": f"A-{300 + i % 20}"}],
+                "groups": [{"id": 800 + i % 6, "name": f"R-IT 3 UN RV - {i % 6 + 1}. sk IPVB UP3"}],
+                "lecturers": [{"id": 709, "name": "BENCH LECTURER"}],
+                "showLink": "",
+                "color": "",
+                "colorText": "",
+            })
+        with open(os.path.join(path, f"{course_id}.json"), "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False, indent=2)
+
+
+@benchmark
+def bench_parse(files: str = "64", entries: str = "2000"):
+    """parse_all_schedules over a generated schedule dir: streaming vs process pool by worker count."""
+    import parse
+
+    files, entries = int(files), int(entries)
+    cpus = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmpdir:
+        write_schedule_dir(tmpdir, files, entries)
+        parse.SCHEDULE_DIR = tmpdir
+        total = files * entries
+
+        t0 = time.perf_counter()
+        parse.parse_all_schedules()
+        serial = time.perf_counter() - t0
+        print(f"streaming  {total} entries: {serial:.2f}s ({total / serial:.0f} entries/s)")
+
+        workers = 1
+        while workers <= cpus:
+            t0 = time.perf_counter()
+            parse._parse_parallel(workers)
+            elapsed = time.perf_counter() - t0
+            print(f"pool x{workers:<3d} {total} entries: {elapsed:.2f}s ({total / elapsed:.0f} entries/s, "
+                  f"{serial / elapsed:.1f}x)")
+            workers *= 2
+
+
+@benchmark
+def bench_pipeline(courses: str = "16", entries: str = "300", fetch_latency: str = "0.5", rate: str = "1000"):
+    """
+    First full cycle against fake Wise and fake Calendar: main.run_once (fetch all,
+    then diff, then push) vs one round of the pipelined daemon.Daemon.
+    """
+    import signal
+    import threading
+    import functools
+
+    import fetch
+    import main
+    import metrics
+    from daemon import Daemon
+    from fake_wise import FakeWiseServer
+    from fake_calendar import FakeCalendarService
+    from sinks import GoogleSink
+
+    count, entries, latency, rate = int(courses), int(entries), float(fetch_latency), float(rate)
+    os.environ.setdefault("WISE_BASIC_AUTH", "YmVuY2g6YmVuY2g=")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        write_schedule_dir(os.path.join(tmpdir, "schedule"), count, entries)
+        course_map = {str(10000 + f): f"BENCH COURSE {f}" for f in range(count)}
+        with FakeWiseServer(os.path.join(tmpdir, "schedule"), latency=latency) as server:
+            main.COURSES = course_map
+            main.fetch_courses = functools.partial(fetch.fetch_courses, base_url=server.base_url)
+
+            _fresh_db(tmpdir, "sequential.db")
+            service = FakeCalendarService()
+            t0 = time.perf_counter()
+            main.run_once(course_map, [GoogleSink("bench", service=service, rate=rate)])
+            sequential = time.perf_counter() - t0
+            print(f"sequential run_once  {sequential:6.2f}s  ({service.count('bench')} events pushed)")
+
+            _fresh_db(tmpdir, "pipelined.db")
+            service = FakeCalendarService()
+            daemon = Daemon([GoogleSink("bench", service=service, rate=rate)], course_map, base_url=server.base_url)
+            metrics.reset()
+
+            def _stop_after_first_round():
+                while not metrics.snapshot().get("tom_cycles_total"):
+                    time.sleep(0.01)
+                os.kill(os.getpid(), signal.SIGTERM)  # the daemon's own graceful shutdown
+
+            threading.Thread(target=_stop_after_first_round, daemon=True).start()
+            t0 = time.perf_counter()
+            daemon.run_forever()
+            pipelined = time.perf_counter() - t0
+            print(f"pipelined daemon     {pipelined:6.2f}s  ({service.count('bench')} events pushed, "
+                  f"{sequential / pipelined:.1f}x)")
+        db.close()
+
+
+class _LegacyEvent:
+    """The original dict-backed CalendarEvent, for comparison."""
+
+    def __init__(self, uid, course_id, course, execution_type, start_time, end_time,
+                 location, lecturers, groups, note="", google_id=None, disabled=False):
+        self.uid = uid
+        self.course_id = course_id
+        self.course = course
+        self.execution_type = execution_type
+        self.start_time = start_time
+        self.end_time = end_time
+        self.location = location
+        self.lecturers = lecturers
+        self.groups = groups
+        self.note = note
+        self.google_id = google_id
+        self.disabled = disabled
+
+    @property
+    def hash(self):
+        import hashlib
+        raw = "|".join([
+            self.course or "", self.execution_type or "", self.start_time or "",
+            self.end_time or "", self.location or "", self.lecturers or "",
+            self.groups or "", self.note or "",
+        ])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @property
+    def description(self):
+        parts = []
+        if self.lecturers:
+            parts.append(f"Lecturer: {self.lecturers}")
+        if self.groups:
+            parts.append(f"Group: {self.groups}")
+        if self.note:
+            parts.append(f"Note: {self.note}")
+        return "\n".join(parts)
+
+
+@benchmark
+def bench_event(n: str = "100000"):
+    """CalendarEvent memory (bytes/event) and hash/description throughput: legacy dict class vs slotted."""
+    import tracemalloc
+    from parse import entry_fields
+
+    n = int(n)
+    # Field strings are built up front so only the event objects are measured
+    rows = [
+        entry_fields({
+            "id": f"S{i}", "start_time": f"2026-03-{1 + i % 28:02d}T{8 + i % 10:02d}:00:00",
+            "end_time": f"2026-03-{1 + i % 28:02d}T{9 + i % 10:02d}:00:00",
+            "courseId": "1025", "course": "SOCIOLOŠKI IN POKLICNI VIDIKI", "executionType": "SV",
+            "rooms": [{"name": "A-301"}], "groups": [{"name": "R-IT 3 UN SV - 1. sk IPVB UP3"}],
+            "lecturers": [{"name": "GREGA ŽLAHTIČ"}],
+        })
+        for i in range(n)
+    ]
+
+    for label, cls in (("legacy", _LegacyEvent), ("slotted", CalendarEvent)):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        # The legacy class predates start_ts/end_ts, the last two entry_fields
+        events = [cls(*row[:10]) for row in rows] if cls is _LegacyEvent else [cls(*row) for row in rows]
+        size = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        t0 = time.perf_counter()
+        for event in events:
+            event.hash
+        first = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for _ in range(3):  # sync_events + Google body building read these repeatedly
+            for event in events:
+                event.hash
+                event.description
+        repeat = time.perf_counter() - t0
+
+        print(f"{label:8s} {size / n:6.0f} bytes/event, first hash {n / first:9.0f}/s, "
+              f"3x hash+description {3 * n / repeat:9.0f}/s")
+        del events
+
+
+def _legacy_matches_group_filter(entry: dict, allowed_groups: list[str]) -> bool:
+    """The per-entry substring scan parse.GroupMatcher replaced, kept for comparison."""
+    for group in entry.get("groups", []):
+        for allowed in allowed_groups:
+            if allowed.lower() in group["name"].lower():
+                return True
+    return False
+
+
+@benchmark
+def bench_groups(entries: str = "100000", patterns: str = "40"):
+    """Group filtering throughput: legacy substring scan vs compiled, memoised GroupMatcher."""
+    from parse import GroupMatcher
+
+    entries, patterns = int(entries), int(patterns)
+    # A faculty-wide filter: many patterns, and entries drawn from a few hundred groups
+    allowed = [f"RV{i:03d}" for i in range(patterns)]
+    data = [
+        {"groups": [{"id": i % 300, "name": f"R-IT {1 + i % 3} UN - RV{i % 300:03d} IPVB UP3"},
+                    {"id": 1000 + i % 7, "name": f"R-IT {1 + i % 3} UN SV - {i % 7}. sk"}]}
+        for i in range(entries)
+    ]
+
+    t0 = time.perf_counter()
+    legacy = [_legacy_matches_group_filter(entry, allowed) for entry in data]
+    legacy_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    matches = GroupMatcher(allowed)
+    compiled = [matches(entry) for entry in data]
+    compiled_time = time.perf_counter() - t0
+
+    assert legacy == compiled
+    print(f"{entries} entries, {patterns} patterns, {sum(compiled)} kept")
+    print(f"legacy   {entries / legacy_time:10.0f} entries/s")
+    print(f"compiled {entries / compiled_time:10.0f} entries/s  ({legacy_time / compiled_time:.1f}x)")
+
+
+@benchmark
+def bench_times(n: str = "50000"):
+    """Per-event datetime cost: dateutil + pytz on every body build vs fromisoformat once at ingest."""
+    try:
+        import pytz
+        from dateutil import parser as date_parser
+    except ImportError:
+        print("needs pytz and python-dateutil for the legacy side (pip install pytz python-dateutil)")
+        return
+    from sync_google import _build_google_body
+
+    n = int(n)
+    tz = pytz.timezone("Europe/Ljubljana")
+    times = [(e.start_time, e.end_time) for e in synthetic_events(n)]
+
+    def legacy_localize(dt_str):
+        dt = date_parser.parse(dt_str)
+        return dt if dt.tzinfo else tz.localize(dt)
+
+    t0 = time.perf_counter()
+    legacy = [(legacy_localize(start).isoformat(), legacy_localize(end).isoformat()) for start, end in times]
+    legacy_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    events = [CalendarEvent("u", "c", "C", "PR", start, end, "", "", "") for start, end in times]
+    ingest_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    current = [(e.start.isoformat(), e.end.isoformat()) for e in events]
+    format_time = time.perf_counter() - t0
+
+    assert legacy == current
+    body_t0 = time.perf_counter()
+    for event in events:
+        _build_google_body(event)
+    body_time = time.perf_counter() - body_t0
+
+    print(f"legacy   parse + localize + format: {legacy_time / n * 1e6:6.2f} µs/event (on every body build)")
+    print(f"current  parse once at ingest:      {ingest_time / n * 1e6:6.2f} µs/event (includes CalendarEvent)")
+    print(f"current  format per body build:     {format_time / n * 1e6:6.2f} µs/event "
+          f"({legacy_time / format_time:.0f}x faster per build)")
+    print(f"current  whole _build_google_body:  {body_time / n * 1e6:6.2f} µs/event")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        for name, fn in BENCHMARKS.items():
+            print(f"{name:20s} {fn.__doc__}")
+        sys.exit(0 if len(sys.argv) < 2 else 1)
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
@@ -1,80 +1,96 @@
 import os
-import time
 import logging
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
-from db import DB_PATH, get_conn
+import db
+from executor import SyncExecutor, WORKERS, RATE_PER_SECOND
+from sync_google import delete_request, service_factory, drain_outbox
 
 logger = logging.getLogger(__name__)
 
-SCOPES = ["https://www.googleapis.com/auth/calendar"]
-
-
-def _get_service():
-    creds = None
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open("token.json", "w") as f:
-            f.write(creds.to_json())
-    return build("calendar", "v3", credentials=creds)
-
-
-def clear_google_calendar(calendar_id: str):
-    """Delete every event in the given Google Calendar."""
-    logger.info(f"🗑️  Clearing all Google Calendar events for: {calendar_id}")
-    try:
-        service = _get_service()
+PAGE_SIZE = 2500  # events listed per page (the API maximum); each page is deleted before the next is read
+
+
+def _sweep(executor: SyncExecutor, calendar_id: str, keep=None) -> tuple[int, int]:
+    """
+    Delete the calendar's events page by page, except the ids `keep(ids)`
+    returns for a page. Deletes run as batches on the executor's pool under its
+    rate limit.
+
+    Deleting shifts the pages after it, so a pass that deleted anything is
+    followed by another from the first page, until a pass finds nothing left.
+    Whatever is still listed is what remains to do, so an interrupted sweep
+    simply resumes on the next run; the clean_progress:<calendar> meta key only
+    carries the running total. Returns (deleted, failed).
+    """
+    checkpoint = f"clean_progress:{calendar_id}"
+    deleted = int(db.get_meta(checkpoint) or 0)
+    if deleted:
+        logger.info(f"↩️  Resuming: {deleted} events were deleted by an earlier run.")
+    skip = set()  # kept, or already sent a delete on this run (failures are retried on the next run)
+    failed = 0
+    swept = True
+
+    while swept:
+        swept = False
         page_token = None
-        deleted = 0
-
         while True:
-            response = service.events().list(
+            response = executor.call(lambda service: service.events().list(
                 calendarId=calendar_id,
-                maxResults=2500,
-                singleEvents=True,
+                maxResults=PAGE_SIZE,
                 pageToken=page_token,
-            ).execute()
-
-            for item in response.get("items", []):
-                event_id = item["id"]
-                try:
-                    service.events().delete(
-                        calendarId=calendar_id, eventId=event_id
-                    ).execute()
-                    time.sleep(0.05)
-                    deleted += 1
-                    logger.info(f"  🗑️  Deleted: {item.get('summary', event_id)}")
-                except HttpError as e:
-                    logger.warning(f"  ⚠️  Could not delete {event_id}: {e}")
+            ))
+            items = {item["id"]: item for item in response.get("items", []) if item["id"] not in skip}
+            if keep is not None:
+                skip |= keep(list(items))
+            builders = [(event_id, delete_request(calendar_id, event_id)) for event_id in items if event_id not in skip]
+
+            for event_id, (_, error) in executor.run_batch(builders).items():
+                # A gone event may still be listed for a while: never send it again this run
+                skip.add(event_id)
+                if error is not None and error.resp.status not in (404, 410):
+                    logger.warning(f"  ⚠️  Could not delete {event_id}: {error}")
+                    failed += 1
+                    continue
+                deleted += 1
+                swept = True
+                logger.info(f"  🗑️  Deleted: {items[event_id].get('summary', event_id)}")
+            if builders:
+                db.set_meta(checkpoint, str(deleted))
 
             page_token = response.get("nextPageToken")
             if not page_token:
                 break
 
-        logger.info(f"✅ Deleted {deleted} events from Google Calendar.")
+    db.set_meta(checkpoint, None)
+    return deleted, failed
+
+
+def clear_google_calendar(calendar_id: str, workers: int = WORKERS, rate: float = RATE_PER_SECOND, service=None):
+    """Delete every event in the given Google Calendar (or `service`, e.g. fake_calendar). Resumable, see _sweep."""
+    logger.info(f"🗑️  Clearing all Google Calendar events for: {calendar_id}")
+    db.init_db()  # the progress checkpoint lives in meta, which a missing or older DB lacks
+    try:
+        with SyncExecutor(service_factory(service), workers=workers, rate=rate) as executor:
+            deleted, failed = _sweep(executor, calendar_id)
+        logger.info(f"✅ Deleted {deleted} events from Google Calendar" + (f", {failed} failed." if failed else "."))
 
     except HttpError as e:
         logger.error(f"❌ Google Calendar error: {e}")
 
 
 def delete_db():
-    """Drop the local SQLite database file."""
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
-        logger.info(f"✅ Deleted database: {DB_PATH}")
+    """Drop the local SQLite database file (and its WAL side files)."""
+    path = db.current_path()
+    db.close()
+    if os.path.exists(path):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        logger.info(f"✅ Deleted database: {path}")
     else:
-        logger.info(f"ℹ️  Database not found, nothing to delete: {DB_PATH}")
+        logger.info(f"ℹ️  Database not found, nothing to delete: {path}")
 
 
 def clean(calendar_id: str):
@@ -83,3 +99,35 @@ def clean(calendar_id: str):
     clear_google_calendar(calendar_id)
     delete_db()
     logger.info("✅ Clean complete.")
+
+
+def rebuild(calendar_id: str, workers: int = WORKERS, rate: float = RATE_PER_SECOND, service=None):
+    """
+    Make the Google Calendar match the DB again without wiping it: events the
+    DB does not know are deleted, every live event is re-pushed onto its
+    existing google_id (re-inserted only if it is gone) and disabled events
+    still in Google are deleted. Unchanged google_ids mean no duplicate inserts
+    and no churn for subscribers.
+
+    The pushes go through the outbox, so an interrupted rebuild continues on
+    the next run, or on the next normal sync, where it stopped.
+    """
+    logger.info(f"🔁 Rebuilding Google Calendar {calendar_id} from the DB...")
+    checkpoint = f"rebuild:{calendar_id}"
+    if db.get_meta(checkpoint) == "queued":
+        logger.info("↩️  Resuming an interrupted rebuild.")
+        db.outbox_retry_now()
+    else:
+        logger.info(f"Queued {db.requeue_all()} events for a fresh push.")
+        db.set_meta(checkpoint, "queued")
+
+    try:
+        with SyncExecutor(service_factory(service), workers=workers, rate=rate) as executor:
+            deleted, _ = _sweep(executor, calendar_id, keep=db.known_google_ids)
+            done, failed = drain_outbox(executor, calendar_id)
+        if not db.outbox_depth():
+            db.set_meta(checkpoint, None)
+        logger.info(f"✅ Rebuild complete: {deleted} unknown events deleted, {done} pushed, {failed} to retry.")
+
+    except HttpError as e:
+        logger.error(f"❌ Google Calendar error: {e}")
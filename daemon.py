@@ -0,0 +1,288 @@
+import time
+import signal
+import asyncio
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import db
+import metrics
+from fetch import (
+    COURSES, BASE_URL, CONCURRENCY, FetchError, new_session, login, fetch_course,
+    conditional_courses, fetched_entry, mark_synced, window_bounds, archive_cutoff,
+)
+from parse import iter_schedule_bytes
+from scheduler import Scheduler
+from series import collapse_series
+from sinks import Sink
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 4      # courses buffered between two stages; a full queue holds up the stage before it
+PARSE_WORKERS = 2   # courses parsed at the same time (fetching uses fetch.CONCURRENCY)
+
+
+class Daemon:
+    """
+    The sync loop as an asyncio pipeline: each due course flows on its own through
+
+        fetch (CONCURRENCY) → parse (PARSE_WORKERS) → diff (1) → push (1)
+
+    with a bounded queue (QUEUE_SIZE) between two stages, so a slow course only
+    holds up itself and a cycle takes about as long as its slowest stage rather
+    than the sum of them. Blocking work (HTTP, JSON, SQLite, the sinks) runs on
+    threads; the loop only moves courses between queues.
+
+    The diff is the only writer of the DB; the push stage takes every course
+    waiting for it at once, since one sink push drains the whole outbox. Pushes
+    wait on the Google rate limiter, and while one runs the push queue fills up
+    and blocks the diff, which blocks parsing and then fetching: the limiter
+    sets the pace of the whole pipeline instead of letting work pile up.
+
+    Once no course is in flight, the sinks are reconciled and history is
+    archived, as at the end of main.run_once (in memory, as with main.IN_MEMORY;
+    schedule/ is not used). Polling follows the Scheduler's
+    adaptive intervals, per course. SIGINT/SIGTERM stop fetching new courses and
+    drain the ones in flight; a second signal drops whatever is still queued
+    (calls already running finish; anything diffed is in the outbox and is
+    pushed on the next start).
+    """
+
+    def __init__(
+        self,
+        sinks: list[Sink],
+        courses: dict[str, str] = COURSES,
+        default_interval: float = 60 * 60,
+        collapse: bool = False,
+        archive_history: bool = True,
+        base_url: str = BASE_URL,
+    ):
+        self.sinks = sinks
+        self.courses = courses
+        self.scheduler = Scheduler(None, courses, default_interval=default_interval)
+        self.collapse = collapse
+        self.archive_history = archive_history
+        self.base_url = base_url
+        self._in_flight: set[str] = set()
+        self._state: dict[str, tuple] = {}
+        self._manifest: dict[str, tuple] = {}
+        self._token = None
+        self._session = None
+        self._round_start = None
+        self._push_anyway = False  # the DB was empty when the round started, as in main.run_once
+        self._stopping = None
+        self._main = None
+
+    # --- stages -----------------------------------------------------------
+
+    async def _produce(self):
+        """Queue every due course that is not already in flight, then sleep until the next one is due."""
+        # Loaded once: from here on the push stage keeps it (and course_polls) current
+        self._state = await asyncio.to_thread(db.get_poll_state)
+        while not self._stopping.is_set():
+            due = [c for c in self.scheduler.due(self._state, time.time()) if c not in self._in_flight]
+            removed = await asyncio.to_thread(self._removed_courses)
+            if due or removed:
+                await self._start_round(due, removed)
+            wait = self.scheduler.next_wait(self._state, skip=self._in_flight)
+            await asyncio.to_thread(self.scheduler.sleep, wait)
+
+    def _removed_courses(self) -> list[str]:
+        self._manifest = db.get_manifest()
+        return [c for c in db.removed_course_ids(self._manifest, self.courses) if c not in self._in_flight]
+
+    async def _start_round(self, due: list[str], removed: list[str]):
+        if due:
+            try:
+                self._token = await asyncio.to_thread(login, self._session, self.base_url)
+            except (requests.RequestException, FetchError, ValueError) as e:
+                logger.error(f"❌ Wise login failed: {e}")
+                await asyncio.to_thread(self.scheduler.reschedule, self._state, due, None)
+                metrics.inc("tom_fetch_failures_total")
+                due = []
+        if not due and not removed:
+            return
+        if not self._in_flight:
+            self._round_start = time.perf_counter()
+            self._push_anyway = await asyncio.to_thread(db.is_empty)
+        self._in_flight.update(due, removed)
+        if due:
+            logger.info(f"⏰ Polling {len(due)} course(s): {', '.join(due)}")
+
+        for course_id in removed:
+            logger.info(f"Course {course_id} removed — disabling its events.")
+            await self.diff_q.put((course_id, [], None, lambda course_id=course_id: db.update_manifest(course_id, None)))
+        for course_id in due:
+            await self.fetch_q.put((course_id,))
+
+    async def _fetch(self, course_id: str):
+        conditional = course_id in conditional_courses(self._manifest)
+        try:
+            with metrics.timer("tom_stage_seconds", stage="fetch"):
+                fetched = await asyncio.to_thread(
+                    fetch_course, self._session, self.base_url, self._token, course_id, conditional
+                )
+        except (requests.RequestException, FetchError) as e:
+            logger.error(f"❌ Failed to fetch {course_id} ({self.courses[course_id]}): {e}")
+            return await self.push_q.put((course_id, None))
+
+        if fetched.body is None:
+            logger.info(f"⬇️  {course_id} {self.courses[course_id]}: not modified")
+            return await self.push_q.put((course_id, False))
+        logger.info(f"⬇️  {course_id} {self.courses[course_id]}: {len(fetched.body)} bytes")
+        entry = await asyncio.to_thread(fetched_entry, course_id, fetched, self._manifest)
+        if entry is None:
+            return await self.push_q.put((course_id, False))
+        await self.parse_q.put((course_id, fetched, entry))
+
+    def _parse_course(self, course_id: str, body: bytes) -> list:
+        with metrics.stage("parse"):
+            events = list(iter_schedule_bytes(course_id, body))
+            return collapse_series(events) if self.collapse else events
+
+    async def _parse(self, course_id: str, fetched, entry):
+        try:
+            events = await asyncio.to_thread(self._parse_course, course_id, fetched.body)
+        except Exception as e:
+            logger.error(f"Failed to parse {course_id}.json: {e}")
+            return await self.push_q.put((course_id, False))
+
+        await self.diff_q.put((course_id, events, window_bounds(), partial(mark_synced, course_id, entry, fetched)))
+
+    def _diff_course(self, course_id: str, events: list, window, on_success) -> bool:
+        """sync_events for one course. Returns whether anything changed."""
+        created, updated, disabled = db.sync_events(events, course_id=course_id, window=window)
+        on_success()
+        return bool(created or updated or disabled)
+
+    async def _diff(self, course_id: str, events: list, window, on_success):
+        try:
+            changed = await asyncio.to_thread(self._diff_course, course_id, events, window, on_success)
+        except Exception as e:
+            logger.error(f"Failed to sync {course_id}: {e}", exc_info=True)
+            changed = False
+        await self.push_q.put((course_id, changed))
+
+    async def _push(self, batch: list[tuple]):
+        """
+        Push the (course_id, changed) results that are ready (changed is None
+        if the fetch failed), reschedule those courses and close the round if
+        nothing is left in flight.
+        """
+        if self._push_anyway or any(changed for _, changed in batch):
+            self._push_anyway = False
+            logger.info(f"Changes detected — pushing to {', '.join(s.name for s in self.sinks) or 'no sinks'}...")
+            for sink in self.sinks:
+                await asyncio.to_thread(self._run_sink, f"push:{sink.name}", sink.push, [], [])
+
+        polled = [c for c, _ in batch if c in self.courses]  # not the removed ones
+        failed = [c for c, changed in batch if changed is None and c in self.courses]
+        if failed:
+            await asyncio.to_thread(self.scheduler.reschedule, self._state, failed, None)
+            metrics.inc("tom_fetch_failures_total")
+        hits = {c for c, changed in batch if changed}
+        await asyncio.to_thread(self.scheduler.reschedule, self._state, [c for c in polled if c not in failed], hits)
+
+        self._in_flight.difference_update(c for c, _ in batch)
+        if not self._in_flight:
+            await self._finish_round()
+        self.scheduler.wake()  # the finished courses' next polls may be earlier than the producer's sleep
+
+    async def _finish_round(self):
+        for sink in self.sinks:
+            await asyncio.to_thread(self._run_sink, f"reconcile:{sink.name}", sink.reconcile)
+        if self.archive_history:
+            await asyncio.to_thread(db.archive_events, archive_cutoff())
+        total = time.perf_counter() - self._round_start
+        metrics.observe("tom_stage_seconds", total, stage="cycle")
+        metrics.inc("tom_cycles_total", result="ok")
+        logger.info(f"⏱️ cycle took {total:.2f}s")
+
+    @staticmethod
+    def _run_sink(stage: str, fn, *args):
+        try:
+            with metrics.stage(stage):
+                fn(*args)
+        except Exception as e:
+            logger.error(f"Sink {stage} failed: {e}", exc_info=True)
+
+    # --- plumbing ---------------------------------------------------------
+
+    async def _worker(self, name: str, queue: asyncio.Queue, handle):
+        while True:
+            item = await queue.get()
+            try:
+                metrics.set_gauge("tom_daemon_queue_depth", queue.qsize(), stage=name)
+                await handle(*item)
+            except Exception as e:
+                logger.error(f"Unexpected {name} error: {e}", exc_info=True)
+            finally:
+                queue.task_done()
+
+    async def _push_worker(self):
+        while True:
+            batch = [await self.push_q.get()]
+            while not self.push_q.empty():
+                batch.append(self.push_q.get_nowait())
+            metrics.set_gauge("tom_daemon_queue_depth", len(batch), stage="push")
+            try:
+                await self._push(batch)
+            except Exception as e:
+                logger.error(f"Unexpected push error: {e}", exc_info=True)
+                self._in_flight.difference_update(c for c, _ in batch)
+            finally:
+                for _ in batch:
+                    self.push_q.task_done()
+
+    def stop(self):
+        """First call: drain the courses in flight and exit. Second call: drop the queued ones and exit."""
+        if self._stopping.is_set():
+            logger.warning("🛑 Stopping now; queued courses are polled again on the next start.")
+            self._main.cancel()
+            return
+        logger.info("🛑 Shutting down: finishing the courses in flight (signal again to stop now)...")
+        self._stopping.set()
+        self.scheduler.stop()
+
+    def run_forever(self):
+        """Run the pipeline until SIGINT/SIGTERM (see stop)."""
+        try:
+            asyncio.run(self.run())
+        except asyncio.CancelledError:
+            pass
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        # Every stage worker can be in a thread at once, plus the producer's sleep
+        loop.set_default_executor(ThreadPoolExecutor(CONCURRENCY + PARSE_WORKERS + 3, thread_name_prefix="daemon"))
+        self._main = asyncio.current_task()
+        self._stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+
+        self.fetch_q = asyncio.Queue(QUEUE_SIZE)
+        self.parse_q = asyncio.Queue(QUEUE_SIZE)
+        self.diff_q = asyncio.Queue(QUEUE_SIZE)
+        self.push_q = asyncio.Queue(QUEUE_SIZE)
+        self._session = new_session()
+        workers = [
+            *(asyncio.create_task(self._worker("fetch", self.fetch_q, self._fetch)) for _ in range(CONCURRENCY)),
+            *(asyncio.create_task(self._worker("parse", self.parse_q, self._parse)) for _ in range(PARSE_WORKERS)),
+            asyncio.create_task(self._worker("diff", self.diff_q, self._diff)),
+            asyncio.create_task(self._push_worker()),
+        ]
+        try:
+            await self._produce()
+            # Stages drain in order: a course leaves each queue before the next one is joined
+            for queue in (self.fetch_q, self.parse_q, self.diff_q, self.push_q):
+                await queue.join()
+            logger.info("✅ Daemon stopped cleanly.")
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._session.close()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
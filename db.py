@@ -1,18 +1,157 @@
+import time
 import sqlite3
+import hashlib
 import logging
-from CalendarEvent import CalendarEvent
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from typing import Iterable
+
+import metrics
+from CalendarEvent import CalendarEvent, TZ, to_epoch
+from series import collapse_series, with_history, last_end_ts
 
 logger = logging.getLogger(__name__)
 
 DB_PATH = "calendar.db"
+SYNC_CHUNK_SIZE = 500  # fresh events diffed per step (also bounds SQL IN lists)
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # readers never block the writer
+    "PRAGMA synchronous=NORMAL",    # fsync on checkpoint, not every commit (safe with WAL)
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",     # ~20 MB page cache
+)
+
+_conns: dict[str, sqlite3.Connection] = {}
+_locks: dict[str, threading.RLock] = {}  # one per DB file, so tenants' DBs don't block each other
+_lock = threading.Lock()                 # guards _conns and _locks
+_local = threading.local()
+
+
+def current_path() -> str:
+    """The DB file this thread works on: the one selected with use_db, else DB_PATH."""
+    return getattr(_local, "path", None) or DB_PATH
+
+
+@contextmanager
+def use_db(path: str):
+    """Route this thread's DB calls to `path` (e.g. one DB per tenant)."""
+    previous = getattr(_local, "path", None)
+    _local.path = path
+    try:
+        yield
+    finally:
+        _local.path = previous
+
+
+def _path_lock(path: str) -> threading.RLock:
+    with _lock:
+        return _locks.setdefault(path, threading.RLock())
 
 
 def get_conn():
-    return sqlite3.connect(DB_PATH)
+    """Long-lived connection for the current DB file, opened on first use."""
+    path = current_path()
+    with _lock:
+        conn = _conns.get(path)
+        if conn is None:
+            conn = sqlite3.connect(path, check_same_thread=False)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            _conns[path] = conn
+        return conn
+
+
+@contextmanager
+def transaction():
+    """Serialise access to the shared connection; commit on success, roll back on error."""
+    with _path_lock(current_path()):
+        conn = get_conn()
+        try:
+            with conn:
+                yield conn
+        except BaseException:
+            metrics.inc("tom_db_rollbacks_total")
+            raise
+        metrics.inc("tom_db_commits_total")
+
+
+def close():
+    """Close the connection for the current DB file (e.g. before deleting it)."""
+    path = current_path()
+    with _path_lock(path), _lock:
+        conn = _conns.pop(path, None)
+        if conn is not None:
+            conn.close()
+
+
+# Columns added after the first release; _migrate adds them to older DBs.
+MIGRATED_COLUMNS = {
+    "google_hash": "TEXT",   # hash of the body last pushed to Google
+    "google_etag": "TEXT",   # etag Google returned for that push
+    "start_ts": "INTEGER",   # start_time as epoch seconds, for range queries
+    "end_ts": "INTEGER",
+    "recurrence": "TEXT",    # RRULE/EXDATE lines of a collapsed weekly series
+    "last_end_ts": "INTEGER",  # end of the last occurrence (end_ts unless a series), for archiving
+}
+
+INDEXES = {
+    "idx_events_pending": "events (disabled, google_id)",
+    "idx_events_course": "events (course_id)",
+    "idx_events_start": "events (start_ts)",
+    "idx_events_course_start": "events (course_id, start_ts)",  # per-window diffs of one course
+    "idx_events_google_id": "events (google_id)",                # known_google_ids, reconcile lookups
+    "idx_archive_google_id": "events_archive (google_id)",
+}
+
+EVENT_COLUMNS = """
+    uid, course_id, course, execution_type, start_time, end_time,
+    location, lecturers, groups, note, google_id, disabled,
+    google_hash, google_etag, recurrence, start_ts, end_ts
+"""
+
+
+def _migrate(conn):
+    for table in ("events", "events_archive"):
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for column, column_type in MIGRATED_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                logger.info(f"DB migrated: added {table}.{column}")
+
+    # Backfill epoch columns for rows written before they existed
+    rows = conn.execute(
+        "SELECT uid, start_time, end_time FROM events WHERE start_ts IS NULL AND start_time != ''"
+    ).fetchall()
+    if rows:
+        conn.executemany(
+            "UPDATE events SET start_ts = ?, end_ts = ? WHERE uid = ?",
+            [(to_epoch(start), to_epoch(end), uid) for uid, start, end in rows],
+        )
+        logger.info(f"DB migrated: backfilled start_ts/end_ts for {len(rows)} events")
+    rows = conn.execute(
+        "SELECT uid, start_time, end_time, recurrence FROM events WHERE last_end_ts IS NULL AND start_time != ''"
+    ).fetchall()
+    if rows:
+        conn.executemany(
+            "UPDATE events SET last_end_ts = ? WHERE uid = ?",
+            [(last_end_ts(start, end, recurrence), uid) for uid, start, end, recurrence in rows],
+        )
+        logger.info(f"DB migrated: backfilled last_end_ts for {len(rows)} events")
+
+    for name, target in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
 
 
 def init_db():
-    conn = get_conn()
+    with transaction() as conn:
+        _create_tables(conn)
+    logger.info("DB initialised.")
+
+
+def _create_tables(conn):
     conn.execute("""
         CREATE TABLE IF NOT EXISTS events (
             uid          TEXT PRIMARY KEY,
@@ -27,122 +166,619 @@ def init_db():
             note         TEXT,
             hash         TEXT,
             google_id    TEXT,
-            disabled     INTEGER DEFAULT 0
+            disabled     INTEGER DEFAULT 0,
+            google_hash  TEXT,
+            google_etag  TEXT,
+            start_ts     INTEGER,
+            end_ts       INTEGER,
+            recurrence   TEXT,
+            last_end_ts  INTEGER
+        )
+    """)
+    # Finished events moved out of the hot table by archive_events; same columns plus archived_at
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS events_archive (
+            uid          TEXT PRIMARY KEY,
+            course_id    TEXT,
+            course       TEXT,
+            execution_type TEXT,
+            start_time   TEXT,
+            end_time     TEXT,
+            location     TEXT,
+            lecturers    TEXT,
+            groups       TEXT,
+            note         TEXT,
+            hash         TEXT,
+            google_id    TEXT,
+            disabled     INTEGER DEFAULT 0,
+            google_hash  TEXT,
+            google_etag  TEXT,
+            start_ts     INTEGER,
+            end_ts       INTEGER,
+            recurrence   TEXT,
+            last_end_ts  INTEGER,
+            archived_at  REAL
+        )
+    """)
+    _migrate(conn)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key          TEXT PRIMARY KEY,
+            value        TEXT
+        )
+    """)
+    _create_outbox(conn)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS course_polls (
+            course_id    TEXT PRIMARY KEY,
+            interval     REAL,
+            next_poll    REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schedule_files (
+            subject_id   TEXT PRIMARY KEY,
+            size         INTEGER,
+            mtime_ns     INTEGER,
+            digest       TEXT,
+            filter       TEXT
         )
     """)
-    conn.commit()
-    conn.close()
-    logger.info("DB initialised.")
+
+
+def _create_outbox(conn):
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'outbox'").fetchone()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            uid          TEXT PRIMARY KEY,
+            op           TEXT,
+            attempts     INTEGER DEFAULT 0,
+            next_attempt REAL DEFAULT 0,
+            last_error   TEXT,
+            enqueued     REAL,
+            version      INTEGER DEFAULT 0
+        )
+    """)
+    if exists and "version" not in {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}:
+        conn.execute("ALTER TABLE outbox ADD COLUMN version INTEGER DEFAULT 0")
+        logger.info("DB migrated: added outbox.version")
+    if not exists:
+        # Seed from DBs that predate the outbox: never pushed, or disabled but still in Google
+        conn.execute("""
+            INSERT OR IGNORE INTO outbox (uid, op, enqueued)
+            SELECT uid, CASE WHEN disabled THEN 'delete' ELSE 'upsert' END, ?
+            FROM events WHERE (disabled = 0 AND google_id IS NULL) OR (disabled = 1 AND google_id IS NOT NULL)
+        """, (time.time(),))
+
+
+def _row_to_event(row) -> CalendarEvent:
+    uid, course_id, course, execution_type, start_time, end_time, \
+        location, lecturers, groups, note, google_id, disabled, \
+        google_hash, google_etag, recurrence, start_ts, end_ts = row
+    return CalendarEvent(
+        uid=uid,
+        course_id=course_id,
+        course=course,
+        execution_type=execution_type,
+        start_time=start_time,
+        end_time=end_time,
+        location=location,
+        lecturers=lecturers,
+        groups=groups,
+        note=note,
+        google_id=google_id,
+        disabled=bool(disabled),
+        google_hash=google_hash,
+        google_etag=google_etag,
+        recurrence=recurrence,
+        start_ts=start_ts,
+        end_ts=end_ts,
+    )
+
+
+def _query_events(where: str = "", params: tuple = ()) -> list[CalendarEvent]:
+    with transaction() as conn:
+        rows = conn.execute(f"SELECT {EVENT_COLUMNS} FROM events {where}", params).fetchall()
+    return [_row_to_event(row) for row in rows]
 
 
 def load_events_from_db():
-    conn = get_conn()
-    rows = conn.execute("""
-        SELECT uid, course_id, course, execution_type, start_time, end_time,
-               location, lecturers, groups, note, google_id, disabled
-        FROM events
-    """).fetchall()
-    conn.close()
-
-    events = []
-    for row in rows:
-        uid, course_id, course, execution_type, start_time, end_time, \
-            location, lecturers, groups, note, google_id, disabled = row
-        events.append(CalendarEvent(
-            uid=uid,
-            course_id=course_id,
-            course=course,
-            execution_type=execution_type,
-            start_time=start_time,
-            end_time=end_time,
-            location=location,
-            lecturers=lecturers,
-            groups=groups,
-            note=note,
-            google_id=google_id,
-            disabled=bool(disabled),
-        ))
-    return events
+    return _query_events()
+
+
+def iter_events(where: str = "", params: tuple = (), batch: int = SYNC_CHUNK_SIZE):
+    """
+    Stream events matching `where` (a condition, without WHERE) in uid order.
+    Reads `batch` rows per transaction, so a long-running reader (e.g. the ICS
+    server) never holds the lock while its consumer is busy.
+    """
+    condition = f"AND ({where})" if where else ""
+    last_uid = ""
+    while True:
+        rows = _query_events(f"WHERE uid > ? {condition} ORDER BY uid LIMIT ?", (last_uid, *params, batch))
+        yield from rows
+        if len(rows) < batch:
+            return
+        last_uid = rows[-1].uid
+
+
+def course_digests(course_ids=None) -> dict[str, str]:
+    """
+    {course_id: digest of its live events' (uid, hash)}: changes whenever any of
+    the course's visible events is added, changed or disabled.
+    """
+    scope, params = "", ()
+    if course_ids is not None:
+        course_ids = list(course_ids)
+        scope, params = f"AND course_id IN ({', '.join('?' * len(course_ids))})", tuple(course_ids)
+    digests = {}
+    with transaction() as conn:
+        rows = conn.execute(f"""
+            SELECT course_id, uid, hash FROM events WHERE disabled = 0 {scope} ORDER BY course_id, uid
+        """, params)
+        for course_id, uid, event_hash in rows:
+            digest = digests.get(course_id)
+            if digest is None:
+                digest = digests[course_id] = hashlib.sha256()
+            digest.update(f"{uid}\0{event_hash}\n".encode())
+    return {course_id: digest.hexdigest() for course_id, digest in digests.items()}
+
+
+def update_google_id(uid, google_id, etag=None, body_hash=None):
+    """Record the Google state of an event; pass google_id=None after deleting it."""
+    update_google_ids([(uid, google_id, etag, body_hash)])
+
+
+def update_google_ids(rows: list[tuple]):
+    """Bulk update_google_id: rows of (uid, google_id, etag, body_hash), one transaction."""
+    if not rows:
+        return
+    with transaction() as conn:
+        conn.executemany(
+            "UPDATE events SET google_id = ?, google_etag = ?, google_hash = ? WHERE uid = ?",
+            [(google_id, etag, body_hash, uid) for uid, google_id, etag, body_hash in rows],
+        )
+
+
+def _sync_chunk(conn, chunk: list[CalendarEvent], created: list, updated: list):
+    """
+    Diff one chunk of fresh events. Only (uid, hash) pairs go to SQLite, appended
+    to temp.fresh_keys (which keeps every uid seen for the disable step); one
+    join of the chunk's rows against events then finds the new, changed and
+    re-appeared uids, and full rows are bound only for those.
+    """
+    fresh_map = {e.uid: e for e in chunk}  # last one wins if the API repeats a uid
+    first = conn.execute("SELECT coalesce(max(rowid), 0) FROM temp.fresh_keys").fetchone()[0]
+    conn.executemany("INSERT INTO temp.fresh_keys (uid, hash) VALUES (?, ?)", [(e.uid, e.hash) for e in fresh_map.values()])
+    changes = conn.execute("""
+        SELECT f.uid, e.uid IS NULL, e.google_id, e.google_hash, e.google_etag
+        FROM temp.fresh_keys f LEFT JOIN events e ON e.uid = f.uid
+        WHERE f.rowid > ? AND (e.uid IS NULL OR e.hash IS NOT f.hash OR e.disabled)
+    """, (first,)).fetchall()
+    if not changes:
+        return
+
+    inserts = []
+    updates = []
+    for uid, is_new, google_id, google_hash, google_etag in changes:
+        event = fresh_map[uid]
+        fields = _event_fields(event)
+        if is_new:
+            inserts.append(fields)
+            created.append(event)
+        else:
+            # Changed or re-appeared: carry over the Google state so it is updated in place
+            event.google_id, event.google_hash, event.google_etag = google_id, google_hash, google_etag
+            updates.append(fields)
+            updated.append(event)
+
+    conn.executemany("""
+        INSERT INTO events
+            (course_id, course, execution_type, start_time, end_time, location, lecturers,
+             groups, note, hash, start_ts, end_ts, recurrence, last_end_ts, uid, google_id, disabled)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, 0)
+    """, inserts)
+    conn.executemany(UPDATE_EVENT, updates)
+    _enqueue(conn, [(uid, "upsert") for uid, *_ in changes])
+
 
+UPDATE_EVENT = """
+    UPDATE events SET
+        course_id = ?, course = ?, execution_type = ?,
+        start_time = ?, end_time = ?, location = ?,
+        lecturers = ?, groups = ?, note = ?, hash = ?,
+        start_ts = ?, end_ts = ?, recurrence = ?, last_end_ts = ?, disabled = 0
+    WHERE uid = ?
+"""
 
-def update_google_id(uid, google_id):
-    conn = get_conn()
-    conn.execute("UPDATE events SET google_id = ? WHERE uid = ?", (google_id, uid))
-    conn.commit()
-    conn.close()
 
+def _event_fields(event: CalendarEvent) -> tuple:
+    """Parameters for the INSERT in _sync_chunk and for UPDATE_EVENT."""
+    return (
+        event.course_id, event.course, event.execution_type, event.start_time, event.end_time,
+        event.location, event.lecturers, event.groups, event.note, event.hash,
+        event.start_ts, event.end_ts, event.recurrence,
+        last_end_ts(event.start_time, event.end_time, event.recurrence) if event.recurrence else event.end_ts,
+        event.uid,
+    )
 
-def sync_events(fresh_events: list[CalendarEvent]) -> tuple[list[CalendarEvent], list[CalendarEvent]]:
+
+def _stored_series(conn, where: str, params: tuple) -> dict[str, CalendarEvent]:
+    where = f"recurrence IS NOT NULL AND disabled = 0 AND {where}"
+    rows = conn.execute(f"SELECT {EVENT_COLUMNS} FROM events WHERE {where}", params)
+    return {event.uid: event for event in map(_row_to_event, rows)}
+
+
+def _keep_series_history(conn, chunk: list[CalendarEvent], cutoff: int) -> list[CalendarEvent]:
+    """Fresh series that were stored with weeks before the window start get those weeks back (series.with_history)."""
+    uids = [e.uid for e in chunk if e.recurrence]
+    if not uids:
+        return chunk
+    stored = _stored_series(conn, f"start_ts < ? AND uid IN ({', '.join('?' * len(uids))})", (cutoff, *uids))
+    if not stored:
+        return chunk
+    local_cutoff = datetime.fromtimestamp(cutoff, TZ).replace(tzinfo=None)
+    return [with_history(e, stored[e.uid], local_cutoff) if e.uid in stored else e for e in chunk]
+
+
+def _truncate_gone_series(conn, scope: str, params: tuple, cutoff: int) -> list[CalendarEvent]:
+    """
+    Live series that started before the window but are missing from the fresh
+    data keep their weeks before the window start instead of being disabled
+    (deleting them would take their history out of Google). Returns them.
+    """
+    local_cutoff = datetime.fromtimestamp(cutoff, TZ).replace(tzinfo=None)
+    where = f"start_ts < ? AND uid NOT IN (SELECT uid FROM temp.fresh_keys) {scope}"
+    stored = _stored_series(conn, where, (cutoff, *params))
+    truncated = []
+    for old in stored.values():
+        event = with_history(None, old, local_cutoff)
+        if event.hash != old.hash:
+            event.google_id, event.google_hash, event.google_etag = old.google_id, old.google_hash, old.google_etag
+            truncated.append(event)
+    conn.executemany(UPDATE_EVENT, [_event_fields(e) for e in truncated])
+    _enqueue(conn, [(e.uid, "upsert") for e in truncated])
+    return truncated
+
+
+def sync_events(
+    fresh_events: Iterable[CalendarEvent],
+    course_id: str | None = None,
+    window: tuple[int, int] | None = None,
+) -> tuple[list[CalendarEvent], list[CalendarEvent], int]:
     """
     Compare fresh_events against DB.
-    Returns (created, updated) — events that changed and need Google sync.
+    Returns (created, updated, disabled) — events that changed and need Google sync,
+    and the number of events newly disabled.
     Marks DB-only events (removed from API) as disabled.
+
+    Every change is queued in the outbox in the same transaction (see _enqueue),
+    so it reaches Google even if this process dies before pushing it.
+
+    fresh_events may be any iterable (e.g. parse.iter_schedules()); it is consumed
+    in chunks of SYNC_CHUNK_SIZE so memory does not grow with the input size.
+
+    With course_id, fresh_events is that course's complete schedule and only its
+    rows can be disabled (an empty iterable disables the whole course). Without it,
+    fresh_events is everything, and an empty iterable disables nothing.
+
+    With window=(start_ts, end_ts), fresh_events only covers events starting in
+    that range (see fetch.window_bounds): rows outside it are history or not yet
+    fetched, and are left alone. A collapsed series that started before the
+    window keeps its weeks before it (see series.with_history): fresh series
+    get them back, and one gone from the fresh data is cut back to them.
+    """
+    with metrics.stage("diff"):
+        start = time.perf_counter()
+        created, updated, disabled, seen = _sync_events(fresh_events, course_id, window)
+        elapsed = time.perf_counter() - start
+    metrics.inc("tom_events_diffed_total", seen)
+    for change, count in (("created", len(created)), ("updated", len(updated)), ("disabled", disabled)):
+        metrics.inc("tom_events_changed_total", count, change=change)
+    if seen:
+        metrics.set_gauge("tom_diff_events_per_second", seen / elapsed)
+    return created, updated, disabled
+
+
+def sync_courses(parsed, courses, window: tuple[int, int] | None = None, collapse: bool = False, label: str = ""):
     """
-    conn = get_conn()
-    rows = conn.execute("SELECT uid, hash, google_id, disabled FROM events").fetchall()
-    db_map = {row[0]: {"hash": row[1], "google_id": row[2], "disabled": row[3]} for row in rows}
+    Diff courses one at a time. `parsed` yields (course_id, events, error, on_success);
+    on_success runs after that course's diff committed (e.g. to update the manifest).
+    Parsed courses are diffed within `window` (see sync_events), as weekly series
+    with `collapse` (series.collapse_series). Courses synced before but no longer
+    in `courses` get all their events disabled. `label` prefixes the log lines.
+    Returns (created, updated, disabled, changed_courses): the first three as
+    in sync_events, plus the set of course IDs that had any change.
+    """
+    created, updated, disabled = [], [], 0
+    changed_courses = set()
+
+    def _merge(course_id, events, window=None):
+        nonlocal disabled
+        if collapse:
+            events = collapse_series(events)
+        c, u, d = sync_events(events, course_id=course_id, window=window)
+        created.extend(c)
+        updated.extend(u)
+        disabled += d
+        if c or u or d:
+            changed_courses.add(course_id)
+
+    for course_id in removed_course_ids(get_manifest(), courses):
+        logger.info(f"{label}Course {course_id} removed — disabling its events.")
+        _merge(course_id, [])
+        update_manifest(course_id, None)
+
+    for course_id, events, error, on_success in parsed:
+        try:
+            if error is not None:
+                raise error
+            # A parse error mid-stream rolls back this course's diff
+            _merge(course_id, events, window)
+        except Exception as e:
+            logger.error(f"{label}Failed to parse {course_id}.json: {e}")
+            continue
+        on_success()
+
+    return created, updated, disabled, changed_courses
 
-    fresh_map = {e.uid: e for e in fresh_events}
 
+def _sync_events(fresh_events: Iterable[CalendarEvent], course_id: str | None, window) -> tuple[list, list, int, int]:
     created = []
     updated = []
+    seen = 0
+    fresh_events = iter(fresh_events)
 
-    for event in fresh_events:
-        existing = db_map.get(event.uid)
+    with transaction() as conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS fresh_keys (uid TEXT, hash TEXT)")
+        conn.execute("DELETE FROM temp.fresh_keys")
 
-        if existing is None:
-            # New event
-            conn.execute("""
-                INSERT INTO events
-                    (uid, course_id, course, execution_type, start_time, end_time,
-                     location, lecturers, groups, note, hash, google_id, disabled)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, 0)
-            """, (
-                event.uid, event.course_id, event.course, event.execution_type,
-                event.start_time, event.end_time, event.location, event.lecturers,
-                event.groups, event.note, event.hash,
-            ))
-            logger.info(f"[CREATE] {event.uid} — {event.course} {event.start_time}")
-            created.append(event)
+        while True:
+            # Lazy inputs (iter_schedule_bytes, ...) parse as they are pulled
+            with metrics.stage("parse"):
+                chunk = list(islice(fresh_events, SYNC_CHUNK_SIZE))
+            if not chunk:
+                break
+            if window is not None:
+                chunk = _keep_series_history(conn, chunk, window[0])
+            _sync_chunk(conn, chunk, created, updated)
+            seen += len(chunk)
 
-        else:
-            if existing["hash"] != event.hash:
-                # Changed event — re-enable if disabled, update all fields
-                conn.execute("""
-                    UPDATE events SET
-                        course_id = ?, course = ?, execution_type = ?,
-                        start_time = ?, end_time = ?, location = ?,
-                        lecturers = ?, groups = ?, note = ?, hash = ?, disabled = 0
-                    WHERE uid = ?
-                """, (
-                    event.course_id, event.course, event.execution_type,
-                    event.start_time, event.end_time, event.location,
-                    event.lecturers, event.groups, event.note, event.hash,
-                    event.uid,
-                ))
-                # Carry over existing google_id so we can update in place
-                event.google_id = existing["google_id"]
-                logger.info(f"[UPDATE] {event.uid} — {event.course} {event.start_time}")
-                updated.append(event)
-            else:
-                logger.debug(f"[UNCHANGED] {event.uid}")
-
-    # Mark events no longer in fresh data as disabled
-    removed_uids = set(db_map.keys()) - set(fresh_map.keys())
-    for uid in removed_uids:
-        if not db_map[uid]["disabled"]:
-            conn.execute("UPDATE events SET disabled = 1 WHERE uid = ?", (uid,))
-            logger.info(f"[DISABLED] {uid} — no longer in API response")
-
-    conn.commit()
-    conn.close()
+        if not seen and course_id is None:
+            logger.warning("No fresh events — skipping diff so nothing gets disabled.")
+            return created, updated, 0, 0
 
+        # Mark events no longer in fresh data as disabled, in one statement
+        scope, params = ("AND course_id = ?", (course_id,)) if course_id is not None else ("", ())
+        if window is not None:
+            # Series that started before the window are cut back to that history instead
+            updated.extend(_truncate_gone_series(conn, scope, params, window[0]))
+            scope += " AND start_ts >= ? AND (start_ts < ? OR recurrence IS NOT NULL)"
+            params += tuple(window)
+        removed_uids = [row[0] for row in conn.execute(f"""
+            UPDATE events SET disabled = 1
+            WHERE disabled = 0 AND uid NOT IN (SELECT uid FROM temp.fresh_keys) {scope}
+            RETURNING uid
+        """, params)]
+        _enqueue(conn, [(uid, "delete") for uid in removed_uids])
+        conn.execute("DELETE FROM temp.fresh_keys")
+
+    if logger.isEnabledFor(logging.DEBUG):
+        for label, uids in (("CREATE", [e.uid for e in created]), ("UPDATE", [e.uid for e in updated]), ("DISABLED", removed_uids)):
+            for uid in uids:
+                logger.debug(f"[{label}] {uid}")
     logger.info(f"Sync complete: {len(created)} created, {len(updated)} updated, {len(removed_uids)} disabled.")
-    return created, updated, len(removed_uids)
+    return created, updated, len(removed_uids), seen
+
+
+# Outbox: uids whose Google state must catch up with the events table. One row
+# per uid, so repeated changes coalesce; the op is informational, as the drain
+# decides insert / patch / delete from the event's current state.
+
+def _enqueue(conn, rows: list[tuple]):
+    """
+    Queue (uid, op) rows; an already queued uid keeps its attempt count but
+    becomes due now, and its version moves on so a drain that read the row
+    before this change does not clear it (see outbox_done).
+    """
+    now = time.time()
+    conn.executemany("""
+        INSERT INTO outbox (uid, op, enqueued) VALUES (?, ?, ?)
+        ON CONFLICT (uid) DO UPDATE SET op = excluded.op, next_attempt = 0, version = version + 1
+    """, [(uid, op, now) for uid, op in rows])
+
+
+def enqueue(rows: list[tuple]):
+    with transaction() as conn:
+        _enqueue(conn, rows)
+
+
+def outbox_due(limit: int, now: float | None = None) -> list[tuple]:
+    """Up to `limit` (uid, op, attempts, version) rows whose next attempt is due, oldest first."""
+    now = time.time() if now is None else now
+    with transaction() as conn:
+        return conn.execute("""
+            SELECT uid, op, attempts, version FROM outbox WHERE next_attempt <= ?
+            ORDER BY next_attempt, enqueued LIMIT ?
+        """, (now, limit)).fetchall()
+
+
+def outbox_started(uids: list[str]):
+    """Count an attempt before sending it: after a crash, attempts > 0 means it may have reached Google."""
+    with transaction() as conn:
+        conn.executemany("UPDATE outbox SET attempts = attempts + 1 WHERE uid = ?", [(uid,) for uid in uids])
+
+
+def outbox_done(rows: list[tuple]):
+    """
+    Clear pushed (uid, version) rows. A row re-queued while it was being pushed
+    has a newer version and stays, so the later change is pushed too.
+    """
+    with transaction() as conn:
+        conn.executemany("DELETE FROM outbox WHERE uid = ? AND version = ?", rows)
+
+
+def outbox_failed(rows: list[tuple]):
+    """Reschedule (uid, version, error, next_attempt) rows; re-queued rows stay due now."""
+    with transaction() as conn:
+        conn.executemany(
+            "UPDATE outbox SET last_error = ?, next_attempt = ? WHERE uid = ? AND version = ?",
+            [(error, next_attempt, uid, version) for uid, version, error, next_attempt in rows],
+        )
+
+
+def outbox_retry_now():
+    """Make every queued row due, skipping what is left of its backoff."""
+    with transaction() as conn:
+        conn.execute("UPDATE outbox SET next_attempt = 0")
+
+
+def outbox_depth() -> dict[str, int]:
+    """{op: queued rows}, due or waiting for a retry."""
+    with transaction() as conn:
+        return dict(conn.execute("SELECT op, COUNT(*) FROM outbox GROUP BY op").fetchall())
+
+
+def events_by_uid(uids: list[str]) -> dict[str, CalendarEvent]:
+    events = {}
+    for i in range(0, len(uids), SYNC_CHUNK_SIZE):
+        chunk = uids[i:i + SYNC_CHUNK_SIZE]
+        for event in _query_events(f"WHERE uid IN ({', '.join('?' * len(chunk))})", tuple(chunk)):
+            events[event.uid] = event
+    return events
+
+
+def live_events_by_google_id(google_ids: list[str] | None = None) -> dict[str, CalendarEvent]:
+    """{google_id: event} for live pushed events, all of them or just those with the given google_ids."""
+    if google_ids is None:
+        return {e.google_id: e for e in _query_events("WHERE disabled = 0 AND google_id IS NOT NULL")}
+    events = {}
+    for i in range(0, len(google_ids), SYNC_CHUNK_SIZE):
+        chunk = google_ids[i:i + SYNC_CHUNK_SIZE]
+        where = f"WHERE google_id IN ({', '.join('?' * len(chunk))}) AND disabled = 0"
+        for event in _query_events(where, tuple(chunk)):
+            events[event.google_id] = event
+    return events
+
+
+def known_google_ids(google_ids: list[str]) -> set[str]:
+    """The subset of google_ids that belong to an event in the DB (live, disabled or archived)."""
+    known = set()
+    for i in range(0, len(google_ids), SYNC_CHUNK_SIZE):
+        chunk = google_ids[i:i + SYNC_CHUNK_SIZE]
+        marks = ", ".join("?" * len(chunk))
+        with transaction() as conn:
+            known.update(row[0] for row in conn.execute(f"""
+                SELECT google_id FROM events WHERE google_id IN ({marks})
+                UNION ALL SELECT google_id FROM events_archive WHERE google_id IN ({marks})
+            """, chunk + chunk))
+    return known
+
+
+def archive_events(before_ts: int) -> int:
+    """
+    Move events that ended before `before_ts` (see fetch.archive_cutoff) from
+    the hot events table, which every diff, reconcile and export reads, to
+    events_archive. Their Google copies stay: past semesters remain visible
+    in the calendar, they are just no longer synced or served as ICS.
+    A series goes once its last occurrence ended (last_end_ts); rows with
+    outbox work pending wait for it. Returns the number of rows moved.
+    """
+    where = "start_ts < ? AND last_end_ts < ? AND uid NOT IN (SELECT uid FROM outbox)"
+    with transaction() as conn:
+        conn.execute(f"""
+            INSERT OR REPLACE INTO events_archive ({EVENT_COLUMNS}, hash, last_end_ts, archived_at)
+            SELECT {EVENT_COLUMNS}, hash, last_end_ts, ? FROM events WHERE {where}
+        """, (time.time(), before_ts, before_ts))
+        moved = conn.execute(f"DELETE FROM events WHERE {where}", (before_ts, before_ts)).rowcount
+    if moved:
+        logger.info(f"🗄️ Archived {moved} events that ended before {time.strftime('%Y-%m-%d', time.localtime(before_ts))}.")
+    return moved
+
+
+def requeue_all() -> int:
+    """
+    Queue every event for a fresh push onto its existing google_id: live events
+    get their hash and etag cleared, so the drain PATCHes them unconditionally
+    (re-inserting any that are gone); disabled events still in Google are deleted.
+    Returns the number of rows queued.
+    """
+    with transaction() as conn:
+        conn.execute("UPDATE events SET google_hash = NULL, google_etag = NULL WHERE disabled = 0")
+        rows = [(uid, "upsert") for (uid,) in conn.execute("SELECT uid FROM events WHERE disabled = 0")]
+        rows += [(uid, "delete") for (uid,) in conn.execute(
+            "SELECT uid FROM events WHERE disabled = 1 AND google_id IS NOT NULL"
+        )]
+        _enqueue(conn, rows)
+    return len(rows)
+
+
+def active_course_ids() -> set[str]:
+    with transaction() as conn:
+        return {row[0] for row in conn.execute("SELECT DISTINCT course_id FROM events WHERE disabled = 0")}
+
+
+def removed_course_ids(manifest: dict[str, tuple], courses) -> list[str]:
+    """Courses synced before (in `manifest` or with live events) that are no longer in `courses`."""
+    return sorted((set(manifest) | active_course_ids()) - set(courses))
+
+
+def get_manifest() -> dict[str, tuple]:
+    """{subject_id: (size, mtime_ns, digest, filter)} for every schedule file last synced."""
+    with transaction() as conn:
+        rows = conn.execute("SELECT subject_id, size, mtime_ns, digest, filter FROM schedule_files").fetchall()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def update_manifest(subject_id: str, entry: tuple | None):
+    """Record a synced schedule file as (size, mtime_ns, digest, filter); None forgets it."""
+    with transaction() as conn:
+        if entry is None:
+            conn.execute("DELETE FROM schedule_files WHERE subject_id = ?", (subject_id,))
+        else:
+            conn.execute("""
+                INSERT OR REPLACE INTO schedule_files (subject_id, size, mtime_ns, digest, filter)
+                VALUES (?, ?, ?, ?, ?)
+            """, (subject_id, *entry))
+
+
+def get_poll_state() -> dict[str, tuple]:
+    """{course_id: (interval, next_poll)} as saved by the scheduler."""
+    with transaction() as conn:
+        rows = conn.execute("SELECT course_id, interval, next_poll FROM course_polls").fetchall()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def set_poll_state(rows: list[tuple]):
+    """Bulk save (course_id, interval, next_poll) rows."""
+    with transaction() as conn:
+        conn.executemany("""
+            INSERT OR REPLACE INTO course_polls (course_id, interval, next_poll)
+            VALUES (?, ?, ?)
+        """, rows)
+
+
+def get_meta(key, default=None):
+    with transaction() as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def meta_keys(prefix: str) -> list[str]:
+    with transaction() as conn:
+        return [row[0] for row in conn.execute("SELECT key FROM meta WHERE key >= ? AND key < ?", (prefix, prefix + "\uffff"))]
+
+
+def set_meta(key, value):
+    """Store a value in the meta table; value=None removes the key."""
+    with transaction() as conn:
+        if value is None:
+            conn.execute("DELETE FROM meta WHERE key = ?", (key,))
+        else:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
 
 
 def is_empty():
-    conn = get_conn()
-    count = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
-    conn.close()
+    with transaction() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
     return count == 0
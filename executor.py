@@ -0,0 +1,196 @@
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 4
+RATE_PER_SECOND = 10.0    # Calendar API default quota is ~600 requests/minute per user
+BURST = 20                # tokens the bucket can hold when idle
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5        # seconds, doubled on every retry
+BACKOFF_CAP = 32.0
+BATCH_SIZE = 50           # Calendar API recommends at most 50 requests per batch
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = (b"rateLimitExceeded", b"userRateLimitExceeded")
+
+
+def is_retryable(error: HttpError) -> bool:
+    """True for 429/5xx and for 403s that Google uses to signal rate limiting."""
+    status = error.resp.status
+    if status in RETRY_STATUSES:
+        return True
+    if status == 403:
+        content = error.content or b""
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+    return False
+
+
+def _count_error(error: HttpError):
+    metrics.inc("tom_google_errors_total", status=error.resp.status)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, up to `capacity` banked."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        """
+        Take `tokens`, blocking until they are paid for. The bucket may go
+        negative: a request bigger than `capacity` (a whole batch) is charged in
+        full and its caller sleeps off the deficit, and callers behind it wait
+        their turn after that, so the average rate never exceeds `rate`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            metrics.inc("tom_google_throttled_seconds_total", wait)
+            time.sleep(wait)
+
+
+class SyncExecutor:
+    """
+    Runs Google API requests on a thread pool behind a shared TokenBucket.
+    Each worker thread gets its own service object from `service_factory`,
+    because googleapiclient services are not thread-safe.
+    Retryable errors (see is_retryable) back off exponentially with full jitter.
+    """
+
+    def __init__(
+        self,
+        service_factory,
+        workers: int = WORKERS,
+        rate: float = RATE_PER_SECOND,
+        burst: float = BURST,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.service_factory = service_factory
+        self.workers = workers
+        self.limiter = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gsync")
+
+    @property
+    def service(self):
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = self.service_factory()
+        return service
+
+    def backoff(self, attempt: int):
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        metrics.inc("tom_google_retries_total")
+        metrics.inc("tom_google_backoff_seconds_total", delay)
+        time.sleep(delay)
+
+    def call(self, build_request):
+        """
+        Execute a single request built by `build_request(service)`, with retries.
+        Raises the last HttpError if it is not retryable or retries run out.
+        """
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            metrics.inc("tom_google_requests_total", kind="single")
+            try:
+                with metrics.timer("tom_google_request_seconds", kind="single"):
+                    return build_request(self.service).execute()
+            except HttpError as e:
+                _count_error(e)
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                logger.warning(f"⏳ Rate limited ({e.resp.status}), retry {attempt + 1}/{self.max_retries}")
+                self.backoff(attempt)
+                attempt += 1
+
+    def map(self, fn, items):
+        """Run fn over items on the pool; results come back in input order."""
+        return list(self._pool.map(fn, items))
+
+    def run_batch(self, builders: list[tuple[str, object]]) -> dict[str, tuple[dict | None, HttpError | None]]:
+        """
+        Execute (request_id, build_request) pairs as Calendar API batch requests,
+        fanning chunks of BATCH_SIZE out to the pool. Items that fail with a
+        retryable error are re-sent (alone with the other failures of their chunk).
+        Returns {request_id: (response, error)}.
+        """
+        chunks = [builders[i:i + BATCH_SIZE] for i in range(0, len(builders), BATCH_SIZE)]
+        results = {}
+        for chunk_results in self.map(self._run_chunk, chunks):
+            results.update(chunk_results)
+        return results
+
+    def _run_chunk(self, chunk: list[tuple[str, object]]) -> dict:
+        results = {}
+        pending = dict(chunk)
+        attempt = 0
+
+        while pending:
+            responses = {}
+
+            def _callback(request_id, response, exception):
+                responses[request_id] = (response, exception)
+
+            service = self.service
+            batch = service.new_batch_http_request(callback=_callback)
+            for request_id, build_request in pending.items():
+                batch.add(build_request(service), request_id=request_id)
+
+            # Every request inside a batch counts against the quota
+            self.limiter.acquire(len(pending))
+            metrics.inc("tom_google_requests_total", len(pending), kind="batched")
+            try:
+                with metrics.timer("tom_google_request_seconds", kind="batch"):
+                    batch.execute()
+            except HttpError as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    responses = {request_id: (None, e) for request_id in pending}  # counted per item below
+                else:
+                    _count_error(e)
+                    self.backoff(attempt)
+                    attempt += 1
+                    continue
+
+            retry = {}
+            for request_id, (response, error) in responses.items():
+                if error is not None:
+                    _count_error(error)
+                if error is not None and is_retryable(error) and attempt < self.max_retries:
+                    retry[request_id] = pending[request_id]
+                else:
+                    results[request_id] = (response, error)
+
+            if retry:
+                logger.warning(f"⏳ {len(retry)} batched requests rate limited, retry {attempt + 1}/{self.max_retries}")
+                self.backoff(attempt)
+                attempt += 1
+            pending = retry
+
+        return results
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
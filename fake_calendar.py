@@ -0,0 +1,332 @@
+import json
+import time
+import uuid
+import random
+import sqlite3
+import threading
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+def _http_error(status: int, reason: str) -> HttpError:
+    resp = httplib2.Response({"status": status, "reason": reason})
+    return HttpError(resp, reason.encode(), uri="fake://calendar")
+
+
+# Injected failures: status → reason. 403 carries the reason Google uses for quota errors.
+INJECTED_ERRORS = {
+    403: "rateLimitExceeded",
+    429: "Too Many Requests",
+    404: "Not Found",
+}
+
+
+class _FakeRequest:
+    """Mimics googleapiclient's HttpRequest: call .execute() to run it."""
+
+    def __init__(self, service, op, fn, event_ref=None):
+        self._service = service
+        self._op = op
+        self._fn = fn
+        self._event_ref = event_ref  # (calendar_id, event_id) for ops on an existing event
+        self.headers = {}
+
+    def execute(self):
+        t0 = time.perf_counter()
+        self._service.round_trip()
+        try:
+            return self._run()
+        finally:
+            self._service.record(self._op, time.perf_counter() - t0)
+
+    def _run(self):
+        with self._service.lock:
+            self._service.calls += 1
+            self._service.inject_error(self._op, self._event_ref)
+            return self._fn(self)
+
+
+class _FakeBatch:
+    """Mimics BatchHttpRequest: one round trip for every added request."""
+
+    def __init__(self, service, callback):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request_id, request, callback or self._callback))
+
+    def execute(self):
+        t0 = time.perf_counter()
+        self._service.round_trip()
+        for request_id, request, callback in self._requests:
+            try:
+                response, exception = request._run(), None
+            except HttpError as e:
+                response, exception = None, e
+            # Every request in a batch waits for the whole batch
+            self._service.record(request._op, time.perf_counter() - t0)
+            callback(request_id, response, exception)
+
+
+class _MemoryStore:
+    """Events kept in dicts: {calendar_id: {event_id: event}} plus tombstones and change sequence numbers."""
+
+    def __init__(self):
+        self.calendars: dict[str, dict[str, dict]] = {}
+        self.deleted: dict[str, dict[str, dict]] = {}
+        self.changed: dict[tuple[str, str], int] = {}
+
+    def get(self, calendar_id, event_id):
+        return self.calendars.get(calendar_id, {}).get(event_id)
+
+    def put(self, calendar_id, event, sequence):
+        self.calendars.setdefault(calendar_id, {})[event["id"]] = event
+        self.changed[(calendar_id, event["id"])] = sequence
+
+    def remove(self, calendar_id, event_id, sequence):
+        self.calendars.get(calendar_id, {}).pop(event_id, None)
+        self.deleted.setdefault(calendar_id, {})[event_id] = {"id": event_id, "status": "cancelled"}
+        self.changed[(calendar_id, event_id)] = sequence
+
+    def items(self, calendar_id, show_deleted, since):
+        items = list(self.calendars.get(calendar_id, {}).values())
+        if show_deleted:
+            items += self.deleted.get(calendar_id, {}).values()
+        if since is not None:
+            items = [e for e in items if self.changed[(calendar_id, e["id"])] > since]
+        return items
+
+    def count(self, calendar_id):
+        return len(self.calendars.get(calendar_id, {}))
+
+
+class _SqliteStore:
+    """Same interface as _MemoryStore, in a SQLite file: for calendars too big to keep as dicts."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS fake_events (
+                calendar_id  TEXT,
+                event_id     TEXT,
+                body         TEXT,
+                sequence     INTEGER,
+                deleted      INTEGER,
+                PRIMARY KEY (calendar_id, event_id)
+            )
+        """)
+
+    def get(self, calendar_id, event_id):
+        row = self.conn.execute(
+            "SELECT body FROM fake_events WHERE calendar_id = ? AND event_id = ? AND deleted = 0",
+            (calendar_id, event_id),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, calendar_id, event, sequence):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO fake_events VALUES (?, ?, ?, ?, 0)",
+                (calendar_id, event["id"], json.dumps(event), sequence),
+            )
+
+    def remove(self, calendar_id, event_id, sequence):
+        tombstone = json.dumps({"id": event_id, "status": "cancelled"})
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO fake_events VALUES (?, ?, ?, ?, 1)",
+                (calendar_id, event_id, tombstone, sequence),
+            )
+
+    def items(self, calendar_id, show_deleted, since):
+        where = "calendar_id = ?"
+        params = [calendar_id]
+        if not show_deleted:
+            where += " AND deleted = 0"
+        if since is not None:
+            where += " AND sequence > ?"
+            params.append(since)
+        return [json.loads(row[0]) for row in self.conn.execute(f"SELECT body FROM fake_events WHERE {where}", params)]
+
+    def count(self, calendar_id):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM fake_events WHERE calendar_id = ? AND deleted = 0", (calendar_id,)
+        ).fetchone()[0]
+
+
+class _FakeEvents:
+    def __init__(self, service):
+        self._service = service
+
+    def _existing(self, calendar_id, event_id, request):
+        event = self._service.store.get(calendar_id, event_id)
+        if event is None:
+            raise _http_error(404, "Not Found")
+        if_match = request.headers.get("If-Match")
+        if if_match and if_match != event["etag"]:
+            raise _http_error(412, "Precondition Failed")
+        return event
+
+    def _save(self, calendar_id, event):
+        event["etag"] = self._service.next_etag()
+        event.setdefault("status", "confirmed")
+        self._service.store.put(calendar_id, event, self._service.sequence)
+        return dict(event)
+
+    def _request(self, op, fn, calendar_id=None, event_id=None):
+        event_ref = (calendar_id, event_id) if event_id is not None else None
+        return _FakeRequest(self._service, op, fn, event_ref)
+
+    def insert(self, calendarId, body):
+        def run(request):
+            return self._save(calendarId, dict(body, id=uuid.uuid4().hex))
+        return self._request("insert", run)
+
+    def get(self, calendarId, eventId):
+        def run(request):
+            return dict(self._existing(calendarId, eventId, request))
+        return self._request("get", run, calendarId, eventId)
+
+    def update(self, calendarId, eventId, body):
+        def run(request):
+            self._existing(calendarId, eventId, request)
+            return self._save(calendarId, dict(body, id=eventId))
+        return self._request("update", run, calendarId, eventId)
+
+    def patch(self, calendarId, eventId, body):
+        def run(request):
+            event = self._existing(calendarId, eventId, request)
+            return self._save(calendarId, dict(event, **body))
+        return self._request("patch", run, calendarId, eventId)
+
+    def delete(self, calendarId, eventId):
+        def run(request):
+            self._existing(calendarId, eventId, request)
+            self._service.tombstone(calendarId, eventId)
+            return ""
+        return self._request("delete", run, calendarId, eventId)
+
+    def list(
+        self, calendarId, maxResults=250, pageToken=None, syncToken=None, showDeleted=False,
+        privateExtendedProperty=None, **kwargs,
+    ):
+        def run(request):
+            service = self._service
+            if syncToken is not None and int(syncToken) < service.min_sync_token:
+                raise _http_error(410, "Sync token is no longer valid")
+
+            since = int(syncToken) if syncToken is not None else None
+            items = service.store.items(calendarId, showDeleted or since is not None, since)
+            if privateExtendedProperty:
+                key, value = privateExtendedProperty.split("=", 1)
+                items = [e for e in items if e.get("extendedProperties", {}).get("private", {}).get(key) == value]
+            items.sort(key=lambda e: e["id"])
+
+            offset = int(pageToken or 0)
+            page = items[offset:offset + maxResults]
+            response = {"items": [dict(e) for e in page]}
+            if offset + maxResults < len(items):
+                response["nextPageToken"] = str(offset + maxResults)
+            else:
+                response["nextSyncToken"] = str(service.sequence)
+            return response
+        return self._request("list", run)
+
+
+class FakeCalendarService:
+    """
+    Stand-in for the object returned by googleapiclient's build(), for tests and
+    offline load tests. Only the parts of the Calendar v3 API used by this
+    project are implemented. Safe to share between SyncExecutor worker threads.
+
+    latency       seconds slept per HTTP round trip (a single call or a whole batch),
+                  plus up to `jitter` more, uniformly
+    error_rates   {status: probability} of failing a request with an injected
+                  403 (quota), 429 or 404; a 404 first deletes the event, as if a
+                  user had removed it. Seeded by `seed` for repeatable runs.
+    db_path       keep events in a SQLite file instead of in memory
+    `timings` collects the duration of every request per operation
+    (insert/get/patch/update/delete/list), see latency_percentiles.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rates: dict[int, float] | None = None,
+        seed: int | None = None,
+        db_path: str | None = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rates = error_rates or {}
+        self.random = random.Random(seed)
+        self.store = _SqliteStore(db_path) if db_path else _MemoryStore()
+        self.round_trips = 0
+        self.calls = 0
+        self.injected: dict[int, int] = {}
+        self.timings: dict[str, list[float]] = {}
+        self.lock = threading.RLock()
+        # Change tracking for syncToken: every write bumps `sequence`
+        self.sequence = 0
+        self.min_sync_token = 0   # raise to expire older sync tokens (410)
+
+    @property
+    def calendars(self) -> dict[str, dict[str, dict]]:
+        """Live events per calendar (memory store only)."""
+        return self.store.calendars
+
+    def count(self, calendar_id: str) -> int:
+        """Number of live events in a calendar, for either store."""
+        with self.lock:
+            return self.store.count(calendar_id)
+
+    def next_etag(self) -> str:
+        self.sequence += 1
+        return f'"{self.sequence}"'
+
+    def tombstone(self, calendar_id: str, event_id: str):
+        self.sequence += 1
+        self.store.remove(calendar_id, event_id, self.sequence)
+
+    def inject_error(self, op: str, event_ref: tuple | None):
+        """Called under the lock before each request; raises an injected HttpError if the dice say so."""
+        for status, rate in self.error_rates.items():
+            if status == 404 and event_ref is None:
+                continue  # only requests addressing an existing event can 404
+            if rate and self.random.random() < rate:
+                self.injected[status] = self.injected.get(status, 0) + 1
+                if status == 404 and self.store.get(*event_ref) is not None:
+                    self.tombstone(*event_ref)
+                raise _http_error(status, INJECTED_ERRORS.get(status, "Injected"))
+
+    def round_trip(self):
+        with self.lock:
+            self.round_trips += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+
+    def record(self, op: str, seconds: float):
+        with self.lock:
+            self.timings.setdefault(op, []).append(seconds)
+
+    def latency_percentiles(self, *percentiles: float) -> dict[str, list[float]]:
+        """{op: [value at each percentile]} over the recorded request durations."""
+        result = {}
+        with self.lock:
+            for op, values in self.timings.items():
+                values = sorted(values)
+                result[op] = [values[min(len(values) - 1, int(p / 100 * len(values)))] for p in percentiles]
+        return result
+
+    def events(self):
+        return _FakeEvents(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeBatch(self, callback)
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeWiseServer:
+    """
+    Local stand-in for the wise-tt.com REST API, serving <course_id>.json files
+    from `source_dir`. Supports /login and /scheduleByCourse with ETag /
+    If-None-Match and the dateFrom/dateTo range (inclusive, by start date), and
+    sleeps `latency` seconds per request.
+
+        with FakeWiseServer("schedule") as server:
+            fetch.fetch_schedules(base_url=server.base_url)
+    """
+
+    TOKEN = "fake-token"
+
+    def __init__(self, source_dir: str, latency: float = 0.0, port: int = 0):
+        self.source_dir = source_dir
+        self.latency = latency
+        self.requests = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", headers=None):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+
+                url = urlparse(self.path)
+                if url.path.endswith("/login"):
+                    if not self.headers.get("Authorization", "").startswith("Basic "):
+                        return self._send(401)
+                    return self._send(200, f'{{"token": "{server.TOKEN}"}}'.encode())
+
+                if not url.path.endswith("/scheduleByCourse"):
+                    return self._send(404)
+                if self.headers.get("Authorization") != f"Bearer {server.TOKEN}":
+                    return self._send(401)
+
+                query = parse_qs(url.query)
+                course_id = query.get("courseId", [""])[0]
+                path = os.path.join(server.source_dir, f"{os.path.basename(course_id)}.json")
+                if not os.path.exists(path):
+                    return self._send(200, b"[]")
+                with open(path, "rb") as f:
+                    body = f.read()
+                if "dateFrom" in query or "dateTo" in query:
+                    date_from, date_to = query.get("dateFrom", [""])[0], query.get("dateTo", ["9999"])[0]
+                    body = json.dumps([
+                        entry for entry in json.loads(body)
+                        if date_from <= entry.get("start_time", "")[:10] <= date_to
+                    ]).encode()
+
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    with server._lock:
+                        server.not_modified += 1
+                    return self._send(304, headers={"ETag": etag})
+                self._send(200, body, {"Content-Type": "application/json", "ETag": etag})
+
+        return Handler
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
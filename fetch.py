@@ -0,0 +1,258 @@
+import os
+import logging
+import tempfile
+from datetime import date, timedelta
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import db
+from CalendarEvent import to_epoch
+from parse import SCHEDULE_DIR, bytes_manifest_entry, same_filter
+from scheduler import semester_start
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = os.environ.get("WISE_BASE_URL", "https://www.wise-tt.com/WTTWebRestAPI/ws/rest")
+SCHOOL_CODE = "wtt_um_feri"
+LANGUAGE = "slo"
+DATE_FROM = "2026-01-01"
+DATE_TO = "2026-07-01"
+WINDOW_WEEKS: tuple[int, int] | None = None  # (weeks back, weeks ahead): a rolling window instead of DATE_FROM..DATE_TO
+CONCURRENCY = 4   # courses fetched at the same time
+TIMEOUT = 30      # seconds per request
+ENV_FILE = ".env"
+
+# Course IDs to download into schedule/<id>.json, with their names for reference.
+COURSES: dict[str, str] = {
+    "811": "UMETNA INTELIGENCA",
+    "1445": "ALGORITMI IN TEHNIKE ZA UCINKOVITO RESEVANJE PROBLEMOV",
+    "1025": "SOCIOLOSKI IN POKLICNI VIDIKI",
+    "1486": "INTERAKCIJA CLOVEK-RACUNALNIK",
+    "1444": "VESCINE KOMUNICIRANJA V INZENIRSKEM POKLICU",
+}
+
+
+class FetchError(Exception):
+    pass
+
+
+def _load_env(path: str = ENV_FILE):
+    """Read KEY=VALUE lines from .env into os.environ (existing variables win)."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            os.environ.setdefault(key.strip(), value.strip().strip("'\""))
+
+
+def new_session() -> requests.Session:
+    """One pooled session per fetch cycle: keep-alive connections shared by all workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CONCURRENCY)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def login(session: requests.Session, base_url: str) -> str:
+    _load_env()
+    basic_auth = os.environ.get("WISE_BASIC_AUTH")
+    if not basic_auth:
+        raise FetchError("WISE_BASIC_AUTH is not set (.env)")
+    response = session.get(f"{base_url}/login", headers={"Authorization": f"Basic {basic_auth}"}, timeout=TIMEOUT)
+    response.raise_for_status()
+    token = response.json().get("token")
+    if not token:
+        raise FetchError("Failed to get token!")
+    return token
+
+
+def write_atomic(path: str, data: bytes):
+    """Write via a temp file in the same dir + rename, so readers never see half a file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def fetch_window(today: date | None = None) -> tuple[str, str]:
+    """
+    (dateFrom, dateTo) for schedule requests. With WINDOW_WEEKS the window runs
+    from the Monday WINDOW_WEEKS[0] weeks back to the Monday WINDOW_WEEKS[1]
+    weeks ahead; it only moves on Mondays, so responses (and their digests and
+    ETags) stay stable during the week.
+    """
+    if WINDOW_WEEKS is None:
+        return DATE_FROM, DATE_TO
+    today = today or date.today()
+    monday = today - timedelta(days=today.weekday())
+    back, ahead = WINDOW_WEEKS
+    return (monday - timedelta(weeks=back)).isoformat(), (monday + timedelta(weeks=ahead)).isoformat()
+
+
+def window_bounds(today: date | None = None) -> tuple[int, int]:
+    """
+    fetch_window() as epoch seconds [start, end): the range a fetched schedule
+    is complete for. dateTo counts as exclusive, so an event on that day is
+    never disabled just because the API left it out.
+    """
+    date_from, date_to = fetch_window(today)
+    return to_epoch(f"{date_from}T00:00:00"), to_epoch(f"{date_to}T00:00:00")
+
+
+def archive_cutoff(today: date | None = None) -> int:
+    """
+    Events that ended before this can go to the archive (db.archive_events):
+    they are before the fetch window, so no fetch returns them again, and
+    before the current semester.
+    """
+    window_start, _ = window_bounds(today)
+    semester = semester_start(today)
+    return min(window_start, to_epoch(f"{semester.isoformat()}T00:00:00")) if semester else window_start
+
+
+class Fetched(NamedTuple):
+    body: bytes | None   # None when the server answered 304 Not Modified
+    validators: str      # "etag\nlast-modified", see save_validators
+
+
+def fetch_course(session: requests.Session, base_url: str, token: str, course_id: str, conditional: bool) -> Fetched:
+    headers = {"Authorization": f"Bearer {token}"}
+    validators = db.get_meta(f"http_validators:{course_id}") if conditional else None
+    if validators:
+        etag, last_modified = validators.split("\n", 1)
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    date_from, date_to = fetch_window()
+    response = session.get(f"{base_url}/scheduleByCourse", headers=headers, timeout=TIMEOUT, params={
+        "schoolCode": SCHOOL_CODE,
+        "dateFrom": date_from,
+        "dateTo": date_to,
+        "language": LANGUAGE,
+        "courseId": course_id,
+    })
+    if response.status_code == 304:
+        return Fetched(None, validators)
+    response.raise_for_status()
+
+    body = response.content
+    if not body.lstrip().startswith(b"["):
+        # Keep the previous data rather than replace it with an error payload
+        raise FetchError(f"expected a JSON array, got {body[:80]!r}")
+    return Fetched(body, f"{response.headers.get('ETag', '')}\n{response.headers.get('Last-Modified', '')}")
+
+
+def save_validators(course_id: str, fetched: Fetched):
+    """
+    Remember the response validators once its body has been stored or synced;
+    the next fetch of this course is then conditional.
+    """
+    db.set_meta(f"http_validators:{course_id}", fetched.validators)
+
+
+def conditional_courses(manifest: dict[str, tuple]) -> set[str]:
+    """
+    Courses worth a conditional request: their last response made it into the
+    DB under the current group filter. After a filter change the same body
+    must be diffed again, so a 304 would be wrong.
+    """
+    return {course_id for course_id, entry in manifest.items() if same_filter(course_id, entry)}
+
+
+def fetched_entry(course_id: str, fetched: Fetched, manifest: dict[str, tuple]) -> tuple | None:
+    """
+    The manifest entry for a fetched course whose body needs a diff, or None if
+    it does not: a 304, or the same digest and filter as last synced (its
+    validators are saved then, so the next fetch is conditional).
+    """
+    if fetched.body is None:
+        return None
+    entry = bytes_manifest_entry(course_id, fetched.body)
+    old = manifest.get(course_id)
+    if old and old[2:] == entry[2:]:
+        save_validators(course_id, fetched)
+        return None
+    return entry
+
+
+def mark_synced(course_id: str, entry: tuple, fetched: Fetched):
+    """Once a course's diff committed: record its manifest entry and response validators."""
+    db.update_manifest(course_id, entry)
+    save_validators(course_id, fetched)
+
+
+def fetch_courses(
+    courses: dict[str, str] = COURSES,
+    base_url: str = BASE_URL,
+    conditional: set[str] = frozenset(),
+) -> dict[str, Fetched] | None:
+    """
+    Log in once and download every course concurrently (at most CONCURRENCY at a
+    time) over one pooled session, keeping the responses in memory.
+    Courses in `conditional` — those whose last response we still hold — are
+    requested with If-None-Match / If-Modified-Since and may come back as 304.
+    Failed courses are logged and left out. Returns None if login failed.
+    """
+    with new_session() as session:
+        try:
+            token = login(session, base_url)
+        except (requests.RequestException, FetchError, ValueError) as e:
+            logger.error(f"❌ Wise login failed: {e}")
+            return None
+
+        def _fetch(course_id):
+            try:
+                return fetch_course(session, base_url, token, course_id, course_id in conditional), None
+            except (requests.RequestException, FetchError) as e:
+                return None, e
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix="fetch") as pool:
+            for course_id, (fetched, error) in zip(courses, pool.map(_fetch, courses)):
+                if error is not None:
+                    logger.error(f"❌ Failed to fetch {course_id} ({courses[course_id]}): {error}")
+                    continue
+                results[course_id] = fetched
+                status = "not modified" if fetched.body is None else f"{len(fetched.body)} bytes"
+                logger.info(f"⬇️  {course_id} {courses[course_id]}: {status}")
+
+    logger.info(f"✅ Schedules downloaded: {len(results)}/{len(courses)}.")
+    return results
+
+
+def write_snapshot(course_id: str, fetched: Fetched):
+    """Write a fetched course to schedule/<id>.json."""
+    os.makedirs(SCHEDULE_DIR, exist_ok=True)
+    write_atomic(os.path.join(SCHEDULE_DIR, f"{course_id}.json"), fetched.body)
+
+
+def fetch_schedules(courses: dict[str, str] = COURSES, base_url: str = BASE_URL) -> set[str] | None:
+    """
+    Download every course into schedule/ (the on-disk mode; see fetch_courses).
+    A failed course keeps its previous file.
+    Returns the IDs of the courses fetched, or None if login failed or no course could be fetched.
+    """
+    have_file = {c for c in courses if os.path.exists(os.path.join(SCHEDULE_DIR, f"{c}.json"))}
+    results = fetch_courses(courses, base_url, conditional=have_file)
+    if not results:
+        return None
+
+    for course_id, fetched in results.items():
+        if fetched.body is not None:
+            write_snapshot(course_id, fetched)
+            save_validators(course_id, fetched)
+    return set(results)
@@ -0,0 +1,237 @@
+import os
+import zlib
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import db
+from CalendarEvent import CalendarEvent
+from fetch import write_atomic
+
+logger = logging.getLogger(__name__)
+
+ICS_DIR = "ics"
+ICS_PORT = 8766
+PRODID = "-//tom-calendar//Wise timetable//SL"
+UID_DOMAIN = "tom-calendar"
+WRITE_BUFFER = 64 * 1024  # bytes collected before each write/send
+
+# Europe/Ljubljana, as the RRULE-based VTIMEZONE clients expect next to TZID= times
+VTIMEZONE = [
+    "BEGIN:VTIMEZONE",
+    "TZID:Europe/Ljubljana",
+    "BEGIN:DAYLIGHT",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0200",
+    "TZNAME:CEST",
+    "DTSTART:19700329T020000",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "END:DAYLIGHT",
+    "BEGIN:STANDARD",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0100",
+    "TZNAME:CET",
+    "DTSTART:19701025T030000",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+]
+
+
+def _escape(text: str) -> str:
+    return (text or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _fold(line: str) -> str:
+    """RFC 5545 line folding: at most 75 octets per line, never splitting a UTF-8 character."""
+    data = line.encode()
+    if len(data) <= 75:
+        return line + "\r\n"
+    parts = []
+    start, limit = 0, 75
+    while start < len(data):
+        end = min(start + limit, len(data))
+        while end < len(data) and (data[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(data[start:end].decode())
+        start, limit = end, 74  # continuation lines start with a space
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _local(dt: datetime) -> str:
+    return dt.strftime("%Y%m%dT%H%M%S")
+
+
+def event_lines(event: CalendarEvent, stamp: str) -> list[str]:
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{event.uid}@{UID_DOMAIN}",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART;TZID=Europe/Ljubljana:{_local(event.start)}",
+        f"DTEND;TZID=Europe/Ljubljana:{_local(event.end)}",
+        f"SUMMARY:{_escape(event.summary)}",
+    ]
+    if event.description:
+        lines.append(f"DESCRIPTION:{_escape(event.description)}")
+    if event.location:
+        lines.append(f"LOCATION:{_escape(event.location)}")
+    if event.recurrence:
+        lines.extend(event.recurrence.split("\n"))
+    lines.append("END:VEVENT")
+    return lines
+
+
+def iter_ics(events, name: str):
+    """
+    Stream a VCALENDAR for `events` (any iterable, e.g. db.iter_events) as
+    encoded chunks of about WRITE_BUFFER bytes; memory does not grow with the feed.
+    """
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    header = ["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{PRODID}", "CALSCALE:GREGORIAN",
+              f"X-WR-CALNAME:{_escape(name)}", "X-WR-TIMEZONE:Europe/Ljubljana", *VTIMEZONE]
+    buf = [_fold(line) for line in header]
+    size = 0
+    for event in events:
+        for line in event_lines(event, stamp):
+            folded = _fold(line)
+            buf.append(folded)
+            size += len(folded)
+        if size >= WRITE_BUFFER:
+            yield "".join(buf).encode()
+            buf, size = [], 0
+    buf.append(_fold("END:VCALENDAR"))
+    yield "".join(buf).encode()
+
+
+def _feed_events(course_ids: list[str] | None = None, types: list[str] | None = None):
+    where, params = "disabled = 0", []
+    if course_ids:
+        where += f" AND course_id IN ({', '.join('?' * len(course_ids))})"
+        params += course_ids
+    if types:
+        where += f" AND execution_type IN ({', '.join('?' * len(types))})"
+        params += types
+    return db.iter_events(where, tuple(params))
+
+
+def course_path(course_id: str) -> str:
+    return os.path.join(ICS_DIR, f"{os.path.basename(course_id)}.ics")
+
+
+def export_ics(course_ids=None) -> list[str]:
+    """
+    Render ics/<course_id>.ics for every course (or just `course_ids`) whose live
+    events changed since its file was written; unchanged courses are not touched.
+    Returns the course IDs that were rendered.
+    """
+    os.makedirs(ICS_DIR, exist_ok=True)
+    digests = db.course_digests(course_ids)
+    if course_ids is None:
+        # Courses whose last live event went away still need an (empty) re-render
+        course_ids = set(digests) | {key.split(":", 1)[1] for key in db.meta_keys("ics_digest:")}
+    rendered = []
+    for course_id in sorted(course_ids):
+        digest = digests.get(course_id, "")
+        key = f"ics_digest:{course_id}"
+        if db.get_meta(key) == digest and os.path.exists(course_path(course_id)):
+            continue
+        data = b"".join(iter_ics(_feed_events([course_id]), f"Course {course_id}"))
+        write_atomic(course_path(course_id), data)
+        db.set_meta(key, digest)
+        rendered.append(course_id)
+    if rendered:
+        logger.info(f"📅 ICS rendered for {len(rendered)} course(s): {', '.join(rendered)}")
+    return rendered
+
+
+def _etag(*parts: str) -> str:
+    return '"' + hashlib.sha256("\0".join(parts).encode()).hexdigest()[:32] + '"'
+
+
+class IcsServer:
+    """
+    Serves calendar subscriptions over HTTP:
+      /<course_id>.ics            the file rendered by export_ics
+      /calendar.ics?course=811&course=1025&type=PR
+                                  any selection, streamed straight from the DB
+    Responses carry an ETag (304 on If-None-Match) and are gzipped for clients
+    that accept it. Only reads the DB, so it can run next to the sync loop.
+    """
+
+    def __init__(self, port: int = ICS_PORT, host: str = "127.0.0.1"):
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name="ics")
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.0: the body is streamed without Content-Length and ends with the connection
+
+            def log_message(self, *args):
+                pass
+
+            def _stream(self, etag: str, chunks):
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/calendar; charset=utf-8")
+                self.send_header("ETag", etag)
+                self.send_header("Vary", "Accept-Encoding")
+                if gzip:
+                    self.send_header("Content-Encoding", "gzip")
+                self.end_headers()
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None  # wbits 31 = gzip
+                for chunk in chunks:
+                    self.wfile.write(compressor.compress(chunk) if compressor else chunk)
+                if compressor:
+                    self.wfile.write(compressor.flush())
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                name = url.path.lstrip("/")
+                try:
+                    if name == "calendar.ics":
+                        query = parse_qs(url.query)
+                        course_ids, types = query.get("course"), query.get("type")
+                        digests = db.course_digests(course_ids)
+                        # Weak: same events, but DTSTAMP differs between renders
+                        etag = "W/" + _etag(url.query, *(f"{c}={d}" for c, d in sorted(digests.items())))
+                        return self._stream(etag, iter_ics(_feed_events(course_ids, types), "Timetable"))
+
+                    course_id = name.removesuffix(".ics")
+                    if not name.endswith(".ics") or not os.path.exists(course_path(course_id)):
+                        return self.send_error(404)
+                    etag = _etag(course_id, db.get_meta(f"ics_digest:{course_id}", ""))
+                    with open(course_path(course_id), "rb") as f:
+                        return self._stream(etag, iter(lambda: f.read(WRITE_BUFFER), b""))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client went away mid-stream
+
+        return Handler
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"📡 Serving ICS feeds on {self.base_url}")
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,12 +1,22 @@
-import subprocess
 import logging
-import time
 import os
+from functools import partial
 
-from parse import parse_all_schedules
-from db import init_db, sync_events, is_empty
-from sync_google import sync_to_google
-from clean import clean
+import metrics
+from fetch import (
+    COURSES, fetch_schedules, fetch_courses, write_snapshot, window_bounds, archive_cutoff,
+    conditional_courses, fetched_entry, mark_synced,
+)
+from parse import list_schedules, scan_schedules, iter_schedule_file, iter_schedule_bytes, parse_files_parallel
+from db import init_db, sync_courses, is_empty, get_manifest, update_manifest, removed_course_ids, archive_events
+from sync_google import reconcile_google
+from clean import clean, rebuild
+from scheduler import Scheduler, send_trigger
+from tenants import load_tenants, all_courses, run_tenants
+from ics import export_ics, IcsServer
+from sinks import Sink, GoogleSink, IcsSink
+from daemon import Daemon
+from metrics import MetricsServer
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,70 +26,189 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 CALENDAR_ID = "a43ff19f77f57af42c91a0657c168ce9fa7c47bd79230a09e6aa2bd796685d1a@group.calendar.google.com"
-INTERVAL_SECONDS = 60 * 60  # 1 hour
+INTERVAL_SECONDS = 60 * 60  # starting poll interval per course; the scheduler adapts it
+TRIGGER_PORT = 8765         # localhost port for on-demand cycles (main.py trigger); 0 disables
+PARSE_WORKERS = 1  # >1 parses schedule files on a process pool (worth it for many courses)
+IN_MEMORY = True            # fetch → parse → diff in memory; False uses schedule/ files
+SNAPSHOT_SCHEDULES = False  # in memory mode, also write fetched bodies to schedule/ (debugging)
+COLLAPSE_SERIES = False     # push weekly repeats as one recurring Google event (see series.py)
+GOOGLE_SYNC = True          # GoogleSink: push to Google Calendar; False with ICS_EXPORT for a Google-free setup
+ICS_EXPORT = False          # IcsSink: render ics/<course_id>.ics after every cycle (see ics.py)
+ICS_SERVE = False           # serve ics/ and filtered feeds on ics.ICS_PORT while running
+ARCHIVE_HISTORY = True      # move events before the fetch window and semester to events_archive
+METRICS_SERVE = False       # serve /metrics (Prometheus) and /metrics.json on metrics.METRICS_PORT
+PROFILE_DIR = None          # e.g. "profiles": one cProfile dump per cycle (see metrics.cycle)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-GET_CALENDAR_SCRIPT = os.path.join(SCRIPT_DIR, "get_calendar.sh")
 
 
-def fetch_schedules():
-    logger.info("▶️  Running get_calendar.sh...")
-    result = subprocess.run(
-        ["bash", GET_CALENDAR_SCRIPT],
-        cwd=SCRIPT_DIR,
-        capture_output=True,
-        text=True,
+def sync_schedules():
+    """
+    On-disk mode: parse and diff only the schedule files whose content (or group
+    filter) changed since the last cycle, per course. Courses whose file
+    disappeared get all their events disabled.
+    """
+    if not list_schedules():
+        logger.warning("No schedule files found, skipping sync.")
+        return [], [], 0, set()
+
+    manifest = get_manifest()
+    with metrics.stage("scan"):
+        changed, touched, _ = scan_schedules(manifest)
+    for subject_id, entry in touched.items():
+        update_manifest(subject_id, entry)
+    # Files gone, and courses synced before the manifest existed (live rows, no manifest entry)
+    if not changed and not removed_course_ids(manifest, list_schedules()):
+        logger.info(f"All schedule files unchanged ({len(touched)} re-downloaded identically).")
+        return [], [], 0, set()
+
+    if PARSE_WORKERS > 1:
+        results = parse_files_parallel(list(changed), PARSE_WORKERS)
+    else:
+        results = ((subject_id, iter_schedule_file(subject_id), None) for subject_id in changed)
+    parsed = (
+        (subject_id, events, error, partial(update_manifest, subject_id, changed[subject_id]))
+        for subject_id, events, error in results
     )
-    if result.returncode != 0:
-        logger.error(f"get_calendar.sh failed (exit {result.returncode}):")
-        if result.stdout:
-            logger.error(f"stdout: {result.stdout.strip()}")
-        if result.stderr:
-            logger.error(f"stderr: {result.stderr.strip()}")
-        return False
-    logger.info("✅ Schedules downloaded.")
-    return True
-
-
-def run_once():
-    # 1. Download fresh JSONs
-    if not fetch_schedules():
-        return
-
-    # 2. Parse all JSON files in schedule/
-    events = parse_all_schedules()
-    if not events:
-        logger.warning("No events parsed, skipping sync.")
-        return
-
-    # 3. Sync to DB — detect new / changed / disabled
+    return sync_courses(parsed, list_schedules(), window_bounds(), COLLAPSE_SERIES)
+
+
+def fetch_and_sync(courses: dict[str, str] = COURSES):
+    """
+    In-memory mode: fetched response bodies go straight into the parser and the
+    diff, without writing schedule/ and reading it back. Unchanged courses (304,
+    or the same digest as last synced) are skipped. With SNAPSHOT_SCHEDULES the
+    bodies are also written to schedule/ for debugging.
+    `courses` may be a subset of COURSES (e.g. only the ones due for polling).
+    Returns (failed, the db.sync_courses tuple), with the set of courses that
+    could not be fetched, or None if the fetch failed altogether.
+    """
+    manifest = get_manifest()
+    with metrics.stage("fetch"):
+        results = fetch_courses(courses, conditional=conditional_courses(manifest))
+    if not results:
+        return None
+
+    parsed = []
+    for course_id, fetched in results.items():
+        if SNAPSHOT_SCHEDULES and fetched.body is not None:
+            write_snapshot(course_id, fetched)
+        entry = fetched_entry(course_id, fetched, manifest)
+        if entry is None:
+            continue
+        on_success = partial(mark_synced, course_id, entry, fetched)
+        parsed.append((course_id, iter_schedule_bytes(course_id, fetched.body), None, on_success))
+
+    failed = set(courses) - set(results)
+    if not parsed and not removed_course_ids(manifest, COURSES):
+        logger.info("All courses unchanged.")
+        return failed, ([], [], 0, set())
+    return failed, sync_courses(parsed, COURSES, window_bounds(), COLLAPSE_SERIES)
+
+
+def default_sinks() -> list[Sink]:
+    sinks = []
+    if GOOGLE_SYNC:
+        sinks.append(GoogleSink(CALENDAR_ID))
+    if ICS_EXPORT:
+        sinks.append(IcsSink())
+    return sinks
+
+
+def run_once(
+    courses: dict[str, str] | None = None, sinks: list[Sink] | None = None
+) -> tuple[set[str], set[str]] | None:
+    """
+    One fetch → diff → push cycle, for all COURSES or just `courses`, into
+    `sinks` (default_sinks() unless given).
+    Returns (changed, failed): the IDs of courses whose schedule changed and of
+    those that could not be fetched; or None if the fetch failed altogether.
+    Stage timings and counters go to metrics (see metrics.cycle).
+    """
+    courses = COURSES if courses is None else courses
+    sinks = default_sinks() if sinks is None else sinks
+    with metrics.cycle():
+        result = _run_cycle(courses, sinks)
+    if result is None or result[1]:
+        metrics.inc("tom_fetch_failures_total")
+    return result
+
+
+def _run_cycle(courses: dict[str, str], sinks: list[Sink]) -> tuple[set[str], set[str]] | None:
     empty_before = is_empty()
-    created, updated, removed = sync_events(events)
+    if IN_MEMORY:
+        # 1-3. Fetch, parse and diff changed courses without touching schedule/
+        result = fetch_and_sync(courses)
+        if result is None:
+            return None
+        failed, (created, updated, removed, changed_courses) = result
+    else:
+        # 1. Download fresh JSONs
+        with metrics.stage("fetch"):
+            fetched = fetch_schedules(courses)
+        if fetched is None:
+            return None
+        failed = set(courses) - fetched
+
+        # 2 + 3. Parse changed schedule files into the DB diff — detect new / changed / disabled
+        created, updated, removed, changed_courses = sync_schedules()
 
-    # 4. Push to Google Calendar only if there are changes
+    # 4. Push to the sinks only if there are changes
     if empty_before or created or updated or removed:
-        logger.info("Changes detected — syncing to Google Calendar...")
-        sync_to_google(CALENDAR_ID, created, updated)
+        logger.info(f"Changes detected — pushing to {', '.join(s.name for s in sinks) or 'no sinks'}...")
+        for sink in sinks:
+            with metrics.stage(f"push:{sink.name}"):
+                sink.push(created, updated)
     else:
-        logger.info("No changes — nothing to push to Google Calendar.")
+        logger.info("No changes — nothing to push.")
 
+    # 5. Repair drift in the sinks (manual edits/deletions in Google only read remote deltas)
+    for sink in sinks:
+        with metrics.stage(f"reconcile:{sink.name}"):
+            sink.reconcile()
 
-def main():
-    os.chdir(SCRIPT_DIR)
-    init_db()
+    # 6. Keep the hot table to the fetch window: finished history moves to the archive
+    if ARCHIVE_HISTORY:
+        archive_events(archive_cutoff())
+    return changed_courses, failed
 
-    logger.info("🚀 tom-calendar started. Running every hour.")
-    while True:
-        try:
-            run_once()
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}", exc_info=True)
 
-        logger.info(f"💤 Sleeping for {INTERVAL_SECONDS // 60} minutes...")
-        time.sleep(INTERVAL_SECONDS)
+def main(multi_tenant: bool = False, pipelined: bool = False):
+    os.chdir(SCRIPT_DIR)
+    init_db()  # the default DB also holds the scheduler state in multi-tenant mode
+    metrics.PROFILE_DIR = PROFILE_DIR
+
+    daemon = None
+    if multi_tenant:
+        tenants = load_tenants()
+        logger.info(f"👥 Multi-tenant mode: {len(tenants)} tenants.")
+        scheduler = Scheduler(partial(run_tenants, tenants), all_courses(tenants), default_interval=INTERVAL_SECONDS)
+    elif pipelined:
+        daemon = Daemon(
+            default_sinks(), COURSES, default_interval=INTERVAL_SECONDS,
+            collapse=COLLAPSE_SERIES, archive_history=ARCHIVE_HISTORY,
+        )
+        scheduler = daemon.scheduler
+    else:
+        scheduler = Scheduler(run_once, COURSES, default_interval=INTERVAL_SECONDS)
+    scheduler.install_signal_handler()
+    if TRIGGER_PORT:
+        scheduler.serve_triggers(TRIGGER_PORT)
+    if ICS_SERVE:
+        IcsServer().start()
+    if METRICS_SERVE:
+        MetricsServer().start()
+
+    if daemon:
+        logger.info("🚀 tom-calendar started as a pipelined daemon with adaptive polling.")
+        daemon.run_forever()
+        return
+    logger.info("🚀 tom-calendar started with adaptive polling.")
+    scheduler.run_forever()
 
 
 if __name__ == "__main__":
     import sys
+    import threading
 
     if len(sys.argv) > 1 and sys.argv[1] == "clean":
         os.chdir(SCRIPT_DIR)
@@ -93,5 +222,30 @@ if __name__ == "__main__":
             clean(CALENDAR_ID)
         else:
             print("Aborted.")
+    elif len(sys.argv) > 1 and sys.argv[1] == "trigger":
+        # Ask a running instance for an immediate cycle: main.py trigger [course_id ...]
+        send_trigger(TRIGGER_PORT, sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "tenants":
+        # Serve every tenant in tenants.json from one process
+        main(multi_tenant=True)
+    elif len(sys.argv) > 1 and sys.argv[1] == "daemon":
+        # Courses flow through fetch → parse → diff → push concurrently (see daemon.Daemon)
+        main(pipelined=True)
+    elif len(sys.argv) > 1 and sys.argv[1] == "ics":
+        # Render ics/ from the DB and serve it, without syncing: main.py ics
+        os.chdir(SCRIPT_DIR)
+        init_db()
+        export_ics()
+        with IcsServer():
+            threading.Event().wait()
+    elif len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        # Re-push the DB onto the existing Google events instead of clean + full re-insert
+        os.chdir(SCRIPT_DIR)
+        init_db()
+        rebuild(CALENDAR_ID)
+    elif len(sys.argv) > 1 and sys.argv[1] == "reconcile":
+        os.chdir(SCRIPT_DIR)
+        init_db()
+        reconcile_google(CALENDAR_ID)
     else:
         main()
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import bisect
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = 8767
+PROFILE_DIR = None   # directory for one cProfile dump per cycle (load with pstats); None disables
+PROFILE_KEEP = 20    # newest dumps kept in PROFILE_DIR
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)  # seconds
+
+_lock = threading.Lock()
+_types: dict[str, str] = {}                      # metric name → counter / gauge / histogram
+_values: dict[tuple[str, tuple], float] = {}     # (name, labels) → counter or gauge value
+_histograms: dict[tuple[str, tuple], list] = {}  # (name, labels) → [bucket counts..., count, sum]
+_local = threading.local()                       # per thread: stage stack, open cycle() (stage → seconds)
+
+
+def _key(name: str, kind: str, labels: dict) -> tuple[str, tuple]:
+    _types.setdefault(name, kind)
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    with _lock:
+        key = _key(name, "counter", labels)
+        _values[key] = _values.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    with _lock:
+        _values[_key(name, "gauge", labels)] = value
+
+
+def observe(name: str, value: float, **labels):
+    """Add one observation (usually seconds) to a histogram with BUCKETS."""
+    with _lock:
+        key = _key(name, "histogram", labels)
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        hist[bisect.bisect_left(BUCKETS, value)] += 1  # counts per bucket, cumulated on export
+        hist[-2] += 1
+        hist[-1] += value
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """Observe how long the block took into histogram `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time one pipeline stage (fetch, parse, diff, push, ...). Stages nest and
+    count exclusive time: parse running inside diff is not billed to diff too.
+    Inside a cycle() the stage's time adds to that cycle's total for the stage
+    (stages on in_cycle worker threads, e.g. tenants, add up, so they can exceed
+    the wall time); outside one, every stage is observed on its own.
+    """
+    stack = getattr(_local, "stages", None)
+    if stack is None:
+        stack = _local.stages = []
+    frame = [time.perf_counter(), 0.0]  # start, time spent in nested stages
+    stack.append(frame)
+    try:
+        yield
+    finally:
+        stack.pop()
+        elapsed = time.perf_counter() - frame[0]
+        if stack:
+            stack[-1][1] += elapsed
+        _add_stage(name, elapsed - frame[1])
+
+
+def _add_stage(name: str, seconds: float):
+    stages = getattr(_local, "cycle", None)
+    if stages is None:
+        observe("tom_stage_seconds", seconds, stage=name)
+        return
+    with _lock:
+        stages[name] = stages.get(name, 0.0) + seconds
+
+
+@contextmanager
+def cycle(name: str = "cycle"):
+    """
+    One sync cycle: stage times inside it are summed and observed once per
+    cycle into tom_stage_seconds, next to the whole cycle's wall time, and a
+    one-line breakdown is logged. With PROFILE_DIR set the calling thread is
+    run under cProfile and dumped to PROFILE_DIR/<name>-<time>.prof.
+    The cycle belongs to the calling thread, so cycles on other threads stay
+    apart; see in_cycle for worker threads that should add to it.
+    """
+    outer = getattr(_local, "cycle", None)
+    stages = _local.cycle = {}
+    profiler = cProfile.Profile() if PROFILE_DIR else None
+    start = time.perf_counter()
+    ok = False
+    try:
+        if profiler:
+            profiler.enable()
+        yield
+        ok = True
+    finally:
+        if profiler:
+            profiler.disable()
+        total = time.perf_counter() - start
+        _local.cycle = outer
+        with _lock:
+            stages = dict(stages)
+        for stage_name, seconds in stages.items():
+            observe("tom_stage_seconds", seconds, stage=stage_name)
+        observe("tom_stage_seconds", total, stage=name)
+        inc("tom_cycles_total", result="ok" if ok else "error")
+        breakdown = ", ".join(f"{s} {t:.2f}s" for s, t in sorted(stages.items(), key=lambda item: -item[1]))
+        logger.info(f"⏱️ {name} took {total:.2f}s" + (f" ({breakdown})" if breakdown else ""))
+        if profiler:
+            _dump_profile(profiler, name)
+
+
+def in_cycle(fn):
+    """Wrap fn for a worker thread (e.g. a pool) so its stages add to the calling thread's cycle()."""
+    stages = getattr(_local, "cycle", None)
+
+    def run(*args, **kwargs):
+        outer, _local.cycle = getattr(_local, "cycle", None), stages
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.cycle = outer
+
+    return run
+
+
+def _dump_profile(profiler: cProfile.Profile, name: str):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+    profiler.dump_stats(path)
+    logger.info(f"🔬 Profile written to {path}")
+    dumps = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".prof"))
+    for old in dumps[:-PROFILE_KEEP]:
+        os.remove(os.path.join(PROFILE_DIR, old))
+
+
+def reset():
+    """Forget every metric (e.g. between benchmark runs)."""
+    with _lock:
+        _types.clear()
+        _values.clear()
+        _histograms.clear()
+
+
+def snapshot() -> dict:
+    """
+    Every metric as JSON-friendly data:
+    {name: {"type": ..., "series": [{"labels": {...}, "value": x}]}};
+    histogram series carry count, sum and cumulative {le: count} buckets instead of value.
+    """
+    with _lock:
+        result = {name: {"type": kind, "series": []} for name, kind in sorted(_types.items())}
+        for (name, labels), value in sorted(_values.items()):
+            result[name]["series"].append({"labels": dict(labels), "value": value})
+        for (name, labels), hist in sorted(_histograms.items()):
+            cumulative, buckets = 0, {}
+            for le, count in zip([*map(str, BUCKETS), "+Inf"], hist[:-2]):
+                cumulative += count
+                buckets[le] = cumulative
+            result[name]["series"].append(
+                {"labels": dict(labels), "count": hist[-2], "sum": hist[-1], "buckets": buckets}
+            )
+    return result
+
+
+def _labels(labels: dict, **extra) -> str:
+    pairs = {**labels, **extra}
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in pairs.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(pairs, escaped)) + "}"
+
+
+def render_prometheus() -> str:
+    """snapshot() in the Prometheus text exposition format."""
+    lines = []
+    for name, metric in snapshot().items():
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for series in metric["series"]:
+            labels = series["labels"]
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_labels(labels)} {series['value']}")
+                continue
+            for le, count in series["buckets"].items():
+                lines.append(f"{name}_bucket{_labels(labels, le=le)} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {series['sum']}")
+            lines.append(f"{name}_count{_labels(labels)} {series['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serves the metrics on localhost: /metrics in Prometheus text format,
+    /metrics.json as snapshot().
+    """
+
+    def __init__(self, port: int = METRICS_PORT, host: str = "127.0.0.1"):
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name="metrics")
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/metrics":
+                    body, content_type = render_prometheus().encode(), "text/plain; version=0.0.4"
+                elif path == "/metrics.json":
+                    body, content_type = json.dumps(snapshot()).encode(), "application/json"
+                else:
+                    return self.send_error(404)
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"📈 Serving metrics on {self.base_url}/metrics")
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,27 +1,44 @@
 import json
 import os
+import re
+import hashlib
 import logging
-from CalendarEvent import CalendarEvent
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from CalendarEvent import CalendarEvent, to_epoch
 
 logger = logging.getLogger(__name__)
 
 SCHEDULE_DIR = "schedule"
+READ_SIZE = 64 * 1024  # characters read per step when streaming a schedule file
+NUMBER_CHARS = frozenset("0123456789+-.eE")
 
 # Manual group filters per subject ID (filename without .json).
 # Only events whose group names contain at least one of the listed substrings
-# will be included. Subject IDs not listed here are included without filtering.
-# Example:
+# (case-insensitive) will be included. Subject IDs not listed here are included
+# without filtering. Example:
 #   "1025": ["RV1"]        → only RV1 group for subject 1025
 #   "1444": ["RV1", "RV2"] → RV1 and RV2 groups for subject 1444
-GROUP_FILTER: dict[str, list[str]] = {
+# A dict allows finer rules; an event is kept if any of its groups passes
+# (matches an include rule, or there are none, and matches no exclude rule):
+#   "1486": {"include": ["RV"], "exclude": ["RV2"], "ids": [872], "exclude_ids": [901]}
+# "ids"/"exclude_ids" match the group's numeric id in the Wise JSON exactly.
+GROUP_FILTER: dict[str, list[str] | dict] = {
     # "1025": ["RV1"],
 }
 
 
-def parse_entry(entry: dict) -> CalendarEvent:
-    """Convert a single API JSON entry to a CalendarEvent."""
+def entry_fields(entry: dict) -> tuple:
+    """
+    Convert a single API JSON entry to a compact tuple of CalendarEvent fields:
+    (uid, course_id, course, execution_type, start_time, end_time,
+     location, lecturers, groups, note, start_ts, end_ts). Cheap to pickle
+    between processes. Times are parsed here, once, into epoch seconds.
+    """
     api_id = entry.get("id", "")
     start_time = entry.get("start_time", "")
+    end_time = entry.get("end_time", "")
 
     uid = f"{api_id}_{start_time}"
 
@@ -29,67 +46,346 @@ def parse_entry(entry: dict) -> CalendarEvent:
     lecturers = ", ".join(l["name"] for l in entry.get("lecturers", []))
     groups = ", ".join(g["name"] for g in entry.get("groups", []))
 
-    return CalendarEvent(
-        uid=uid,
-        course_id=entry.get("courseId", ""),
-        course=entry.get("course", ""),
-        execution_type=entry.get("executionType", ""),
-        start_time=start_time,
-        end_time=entry.get("end_time", ""),
-        location=location,
-        lecturers=lecturers,
-        groups=groups,
-        note=entry.get("note", ""),
+    return (
+        uid,
+        entry.get("courseId", ""),
+        entry.get("course", ""),
+        entry.get("executionType", ""),
+        start_time,
+        end_time,
+        location,
+        lecturers,
+        groups,
+        entry.get("note", ""),
+        to_epoch(start_time),
+        to_epoch(end_time),
     )
 
 
-def _matches_group_filter(entry: dict, allowed_groups: list[str]) -> bool:
-    """Return True if any group in the entry contains one of the allowed substrings."""
-    for group in entry.get("groups", []):
-        for allowed in allowed_groups:
-            if allowed.lower() in group["name"].lower():
+def parse_entry(entry: dict) -> CalendarEvent:
+    """Convert a single API JSON entry to a CalendarEvent."""
+    return CalendarEvent(*entry_fields(entry))
+
+
+def _substring_pattern(substrings: list[str]) -> re.Pattern | None:
+    """One case-insensitive alternation for all substrings; None when there are none."""
+    if not substrings:
+        return None
+    return re.compile("|".join(map(re.escape, substrings)), re.IGNORECASE)
+
+
+class GroupMatcher:
+    """
+    A group filter (list or dict, see GROUP_FILTER) compiled once. Results are
+    memoised per (group id, group name): a schedule repeats the same few groups
+    on hundreds of entries, so each distinct group is matched only once.
+    """
+
+    __slots__ = ("include", "exclude", "ids", "exclude_ids", "_memo")
+
+    def __init__(self, rules: list[str] | dict):
+        if not isinstance(rules, dict):
+            rules = {"include": rules}
+        self.include = _substring_pattern(rules.get("include"))
+        self.exclude = _substring_pattern(rules.get("exclude"))
+        self.ids = frozenset(rules.get("ids", ()))
+        self.exclude_ids = frozenset(rules.get("exclude_ids", ()))
+        self._memo: dict[tuple, bool] = {}
+
+    def _group_passes(self, group_id, name: str) -> bool:
+        if group_id in self.exclude_ids or (self.exclude and self.exclude.search(name)):
+            return False
+        if self.include is None and not self.ids:
+            return True
+        return group_id in self.ids or bool(self.include and self.include.search(name))
+
+    def __call__(self, entry: dict) -> bool:
+        """True if the entry should be kept."""
+        groups = entry.get("groups")
+        if not groups:
+            return self.include is None and not self.ids
+        memo = self._memo
+        for group in groups:
+            key = (group.get("id"), group["name"])
+            passes = memo.get(key)
+            if passes is None:
+                passes = memo[key] = self._group_passes(*key)
+            if passes:
                 return True
-    return False
+        return False
+
+
+_matchers: dict[str, GroupMatcher] = {}
 
 
-def parse_all_schedules() -> list[CalendarEvent]:
-    """Read all JSON files from the schedule/ dir and return all events."""
-    events = []
+def group_matcher(rules: list[str] | dict | None) -> GroupMatcher | None:
+    """Compiled matcher for a subject's rules (cached by content); None means keep everything."""
+    if not rules:
+        return None
+    key = json.dumps(rules, sort_keys=True)
+    matcher = _matchers.get(key)
+    if matcher is None:
+        matcher = _matchers[key] = GroupMatcher(rules)
+    return matcher
 
+
+def iter_json_array(f, read_size: int = READ_SIZE):
+    """
+    Yield the elements of a top-level JSON array from a text file one at a time,
+    reading `read_size` characters at a time instead of loading the whole file.
+    Raises ValueError if the document is not an array or is malformed.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+    state = "start"   # start → "[" → first/item → value → sep → "," or "]"
+
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n":
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                raise ValueError("unexpected end of JSON array")
+            chunk = f.read(read_size)
+            eof = not chunk
+            buf, pos = chunk, 0
+            continue
+
+        ch = buf[pos]
+        if state == "start":
+            if ch != "[":
+                raise ValueError("expected a JSON array")
+            pos += 1
+            state = "first"
+        elif ch == "]" and state in ("first", "sep"):
+            return
+        elif state == "sep":
+            if ch != ",":
+                raise ValueError(f"expected ',' or ']' in JSON array, got {ch!r}")
+            pos += 1
+            state = "item"
+        else:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # A number running up to the buffer edge may be cut short ("1" of "1.5")
+                truncated = False
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and not eof:
+                    tail = end
+                    while tail < len(buf) and buf[tail] in NUMBER_CHARS:
+                        tail += 1
+                    truncated = tail == len(buf)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                truncated = True
+            if truncated:
+                chunk = f.read(read_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield value
+            pos = end
+            state = "sep"
+            if pos > read_size:
+                buf, pos = buf[pos:], 0
+
+
+def list_schedules() -> list[str]:
+    """Subject IDs of all JSON files in the schedule/ dir, sorted."""
     if not os.path.isdir(SCHEDULE_DIR):
         logger.warning(f"Schedule directory '{SCHEDULE_DIR}' not found.")
-        return events
+        return []
+    return sorted(f[:-5] for f in os.listdir(SCHEDULE_DIR) if f.endswith(".json"))
 
-    for filename in os.listdir(SCHEDULE_DIR):
-        if not filename.endswith(".json"):
+
+def schedule_path(subject_id: str) -> str:
+    return os.path.join(SCHEDULE_DIR, f"{subject_id}.json")
+
+
+def _iter_entries(subject_id: str, entries):
+    """Apply the subject's group filter to raw API entries and yield CalendarEvents."""
+    allowed_groups = GROUP_FILTER.get(subject_id)
+    matches = group_matcher(allowed_groups)
+    filename = f"{subject_id}.json"
+    total = included = 0
+    for entry in entries:
+        total += 1
+        if matches and not matches(entry):
             continue
+        included += 1
+        yield parse_entry(entry)
+
+    if allowed_groups:
+        logger.info(f"Parsed {included}/{total} entries from {filename} (group filter: {allowed_groups})")
+    else:
+        logger.info(f"Parsed {included} entries from {filename}")
+
+
+def iter_schedule_file(subject_id: str):
+    """Stream CalendarEvents from one schedule file, applying its group filter. Raises on bad JSON."""
+    with open(schedule_path(subject_id), "r", encoding="utf-8") as f:
+        yield from _iter_entries(subject_id, iter_json_array(f))
+
 
-        subject_id = filename[:-5]  # strip .json
-        allowed_groups = GROUP_FILTER.get(subject_id)
+def iter_schedule_bytes(subject_id: str, data: bytes):
+    """CalendarEvents from a schedule response body already in memory (no disk round trip)."""
+    entries = json.loads(data)
+    if not isinstance(entries, list):
+        raise ValueError("expected a JSON array")
+    yield from _iter_entries(subject_id, entries)
 
-        filepath = os.path.join(SCHEDULE_DIR, filename)
+
+def decode_schedule(data: bytes) -> list[tuple[dict, tuple]]:
+    """
+    Decode a response body once into (entry, entry_fields) pairs, so several
+    tenants can each filter the same course without re-parsing it (see filter_decoded).
+    """
+    with metrics.stage("parse"):
+        entries = json.loads(data)
+        if not isinstance(entries, list):
+            raise ValueError("expected a JSON array")
+        return [(entry, entry_fields(entry)) for entry in entries]
+
+
+def filter_decoded(subject_id: str, decoded: list[tuple[dict, tuple]], group_filter: dict[str, list[str] | dict]):
+    """CalendarEvents for one tenant from decode_schedule output, applying its group filter."""
+    allowed_groups = group_filter.get(subject_id)
+    matches = group_matcher(allowed_groups)
+    with metrics.stage("parse"):
+        events = [CalendarEvent(*fields) for entry, fields in decoded if not matches or matches(entry)]
+    if allowed_groups:
+        logger.info(f"Parsed {len(events)}/{len(decoded)} entries from {subject_id}.json (group filter: {allowed_groups})")
+    else:
+        logger.info(f"Parsed {len(events)} entries from {subject_id}.json")
+    return events
+
+
+def iter_schedules():
+    """
+    Stream events from all JSON files in the schedule/ dir.
+    Memory stays flat regardless of file size; pair with db.sync_events,
+    which consumes the stream in bounded chunks.
+    """
+    count = 0
+    for subject_id in list_schedules():
         try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            for event in iter_schedule_file(subject_id):
+                count += 1
+                yield event
+        except Exception as e:
+            logger.error(f"Failed to parse {subject_id}.json: {e}")
 
-            if not isinstance(data, list):
-                logger.warning(f"{filename}: expected a JSON array, skipping.")
-                continue
+    logger.info(f"Total events parsed: {count}")
+
+
+def filter_signature(subject_id: str, group_filter: dict[str, list[str] | dict] | None = None) -> str:
+    return json.dumps((GROUP_FILTER if group_filter is None else group_filter).get(subject_id), sort_keys=True)
+
+
+def same_filter(subject_id: str, entry: tuple | None) -> bool:
+    """Whether a manifest entry was diffed under the subject's current group filter."""
+    return entry is not None and entry[3] == filter_signature(subject_id)
+
+
+def scan_schedules(manifest: dict[str, tuple]) -> tuple[dict[str, tuple], dict[str, tuple], list[str]]:
+    """
+    Compare schedule/ against the manifest from db.get_manifest().
+    Returns (changed, touched, removed):
+      changed — {subject_id: manifest entry} for new files, new content or a new group filter
+      touched — {subject_id: manifest entry} for files rewritten with identical content
+      removed — subject IDs in the manifest whose file is gone
+    Unchanged files cost one stat; a digest is only computed when size/mtime moved.
+    """
+    changed = {}
+    touched = {}
+    present = list_schedules()
 
-            included = 0
-            for entry in data:
-                if allowed_groups and not _matches_group_filter(entry, allowed_groups):
-                    continue
-                events.append(parse_entry(entry))
-                included += 1
+    for subject_id in present:
+        st = os.stat(schedule_path(subject_id))
+        filter_sig = filter_signature(subject_id)
+        old = manifest.get(subject_id)
+        if old and old[:2] == (st.st_size, st.st_mtime_ns) and same_filter(subject_id, old):
+            continue
+
+        with open(schedule_path(subject_id), "rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        entry = (st.st_size, st.st_mtime_ns, digest, filter_sig)
+        if old and old[2:] == entry[2:]:
+            touched[subject_id] = entry
+        else:
+            changed[subject_id] = entry
+
+    removed = sorted(set(manifest) - set(present))
+    return changed, touched, removed
+
+
+def bytes_manifest_entry(subject_id: str, data: bytes) -> tuple:
+    """Manifest entry (size, mtime_ns, digest, filter) for an in-memory body; it has no mtime."""
+    return len(data), None, hashlib.sha256(data).hexdigest(), filter_signature(subject_id)
+
+
+def _parse_file_compact(filepath: str, allowed_groups: list[str] | dict | None) -> tuple[int, list[tuple]]:
+    """Process-pool worker: parse one file into (entry count, [entry_fields tuples])."""
+    with open(filepath, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, list):
+        raise ValueError("expected a JSON array")
+    matches = group_matcher(allowed_groups)
+    return len(data), [entry_fields(entry) for entry in data if not matches or matches(entry)]
 
+
+def parse_files_parallel(subject_ids: list[str], workers: int):
+    """
+    Parse schedule files on a process pool.
+    Yields (subject_id, events, error) in the order of subject_ids; exactly one
+    of events/error is None.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_parse_file_compact, schedule_path(subject_id), GROUP_FILTER.get(subject_id))
+            for subject_id in subject_ids
+        ]
+        for subject_id, future in zip(subject_ids, futures):
+            try:
+                with metrics.stage("parse"):
+                    total, rows = future.result()
+            except Exception as e:
+                yield subject_id, None, e
+                continue
+            allowed_groups = GROUP_FILTER.get(subject_id)
             if allowed_groups:
-                logger.info(f"Parsed {included}/{len(data)} entries from {filename} (group filter: {allowed_groups})")
+                logger.info(f"Parsed {len(rows)}/{total} entries from {subject_id}.json (group filter: {allowed_groups})")
             else:
-                logger.info(f"Parsed {included} entries from {filename}")
+                logger.info(f"Parsed {len(rows)} entries from {subject_id}.json")
+            with metrics.stage("parse"):
+                events = [CalendarEvent(*row) for row in rows]
+            yield subject_id, events, None
 
-        except Exception as e:
-            logger.error(f"Failed to parse {filename}: {e}")
 
-    logger.info(f"Total events parsed: {len(events)}")
+def _parse_parallel(workers: int) -> list[CalendarEvent]:
+    """
+    Fan schedule files out to a process pool. Results are merged in filename
+    order (a later file wins on a duplicate uid) and returned sorted by uid,
+    so the output does not depend on which worker finishes first.
+    """
+    merged: dict[str, CalendarEvent] = {}
+    for subject_id, events, error in parse_files_parallel(list_schedules(), workers):
+        if error is not None:
+            logger.error(f"Failed to parse {subject_id}.json: {error}")
+            continue
+        for event in events:
+            merged[event.uid] = event
+
+    events = [merged[uid] for uid in sorted(merged)]
+    logger.info(f"Total events parsed: {len(events)} ({workers} workers)")
     return events
+
+
+def parse_all_schedules(workers: int = 1) -> list[CalendarEvent]:
+    """
+    Read all JSON files from the schedule/ dir and return all events.
+    workers > 1 parses files in parallel on a process pool (see _parse_parallel).
+    """
+    with metrics.stage("parse"):
+        if workers > 1:
+            return _parse_parallel(workers)
+        return list(iter_schedules())
@@ -0,0 +1,204 @@
+import time
+import socket
+import signal
+import logging
+import threading
+import socketserver
+from datetime import date, timedelta
+
+import db
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL = 10 * 60         # never poll a course more often than this
+MAX_INTERVAL = 6 * 60 * 60     # never leave a course alone longer than this
+SPEEDUP = 0.5                  # interval multiplier after a poll that found changes
+SLOWDOWN = 1.5                 # interval multiplier after a poll that found nothing
+
+# First teaching day of each semester. From SEMESTER_LEAD days before until
+# SEMESTER_SETTLE days after, timetables churn, so intervals are capped.
+SEMESTER_STARTS = ["2026-02-16", "2026-10-01"]
+SEMESTER_LEAD = timedelta(days=7)
+SEMESTER_SETTLE = timedelta(days=21)
+SEMESTER_MAX_INTERVAL = 20 * 60
+SIGNAL_POLL = 1.0  # seconds between checks for a trigger signal while sleeping
+
+
+def near_semester_start(today: date | None = None) -> bool:
+    today = today or date.today()
+    for start in map(date.fromisoformat, SEMESTER_STARTS):
+        if start - SEMESTER_LEAD <= today <= start + SEMESTER_SETTLE:
+            return True
+    return False
+
+
+def semester_start(today: date | None = None) -> date | None:
+    """First day of the semester `today` falls in (the latest SEMESTER_STARTS not after it)."""
+    today = today or date.today()
+    return max((start for start in map(date.fromisoformat, SEMESTER_STARTS) if start <= today), default=None)
+
+
+def next_interval(interval: float, changed: bool, today: date | None = None) -> float:
+    """Halve the interval after a change, grow it after a quiet poll, within bounds."""
+    interval *= SPEEDUP if changed else SLOWDOWN
+    upper = SEMESTER_MAX_INTERVAL if near_semester_start(today) else MAX_INTERVAL
+    return max(MIN_INTERVAL, min(upper, interval))
+
+
+class Scheduler:
+    """
+    Polls each course on its own adaptive interval (see next_interval), persisted
+    in the course_polls table. All due courses are handled in one cycle, and cycles
+    never overlap: triggers that arrive mid-cycle queue one more cycle.
+
+    run_cycle(courses) gets a {course_id: name} subset and returns (changed,
+    failed): the course IDs that changed and those that could not be fetched;
+    or None if fetching failed altogether. Failed courses keep their interval
+    and are retried after MIN_INTERVAL.
+    """
+
+    def __init__(self, run_cycle, courses: dict[str, str], default_interval: float = 60 * 60):
+        self.run_cycle = run_cycle
+        self.courses = courses
+        self.default_interval = default_interval
+        self._wake = threading.Event()
+        self._cycle_lock = threading.Lock()
+        self._forced: set[str] = set()
+        self._forced_lock = threading.Lock()
+        self._signals = 0       # bumped by the signal handler only, so it never needs a lock
+        self._signals_seen = 0
+        self._stopped = False
+
+    def trigger(self, course_ids=None):
+        """Request an immediate cycle for course_ids (default: every course)."""
+        with self._forced_lock:
+            self._forced.update(course_ids or self.courses)
+        self._wake.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def due(self, state: dict[str, tuple], now: float) -> dict[str, str]:
+        """Courses due for a poll given the course_polls `state`, plus any triggered ones."""
+        with self._forced_lock:
+            forced, self._forced = self._forced, set()
+        signals = self._signals
+        if signals != self._signals_seen:
+            self._signals_seen = signals
+            forced = set(self.courses)
+        return {
+            course_id: name for course_id, name in self.courses.items()
+            if course_id in forced or course_id not in state or state[course_id][1] <= now
+        }
+
+    def reschedule(self, state: dict[str, tuple], course_ids, changed: set[str] | None):
+        """
+        Store the next poll of course_ids after polling them: `changed` is the
+        set of those that changed, or None if they could not be fetched (they
+        keep their interval and are retried after MIN_INTERVAL).
+        Updates `state` in place.
+        """
+        now = time.time()
+        rows = []
+        for course_id in course_ids:
+            interval, _ = state.get(course_id, (self.default_interval, None))
+            if changed is None:
+                next_poll = now + MIN_INTERVAL
+            else:
+                interval = next_interval(interval, course_id in changed)
+                next_poll = now + interval
+            rows.append((course_id, interval, next_poll))
+            state[course_id] = (interval, next_poll)
+        db.set_poll_state(rows)
+
+    def next_wait(self, state: dict[str, tuple], skip=()) -> float:
+        """Seconds until the next course in `state` (other than `skip`) is due."""
+        now = time.time()
+        upcoming = [state[c][1] for c in self.courses if c in state and c not in skip]
+        return max(1.0, min(upcoming, default=now + MIN_INTERVAL) - now)
+
+    def run_pending(self) -> float:
+        """Run one cycle for every due course. Returns seconds until the next course is due."""
+        with self._cycle_lock:
+            state = db.get_poll_state()
+            due = self.due(state, time.time())
+
+            if due:
+                logger.info(f"⏰ Polling {len(due)} course(s): {', '.join(due)}")
+                try:
+                    result = self.run_cycle(due)
+                except Exception as e:
+                    logger.error(f"Unexpected error: {e}", exc_info=True)
+                    result = None
+                if result is None:
+                    self.reschedule(state, due, None)
+                else:
+                    changed, failed = result
+                    self.reschedule(state, failed, None)
+                    self.reschedule(state, [c for c in due if c not in failed], changed)
+
+            return self.next_wait(state)
+
+    def sleep(self, seconds: float):
+        """Wait up to `seconds`, or until trigger(), wake(), stop() or the trigger signal."""
+        deadline = time.monotonic() + seconds
+        while self._signals == self._signals_seen:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._wake.wait(min(remaining, SIGNAL_POLL)):
+                break
+        self._wake.clear()
+
+    def wake(self):
+        """End a sleep() early, e.g. so a caller re-reads the poll state."""
+        self._wake.set()
+
+    def run_forever(self):
+        while not self._stopped:
+            wait = self.run_pending()
+            logger.info(f"💤 Next poll in {wait / 60:.0f} minutes.")
+            self.sleep(wait)
+
+    def install_signal_handler(self, signum=signal.SIGUSR1):
+        """
+        `kill -USR1 <pid>` triggers an immediate cycle for every course. The
+        handler runs on the main thread between any two bytecodes, possibly
+        inside due() or an Event wait, so it takes no lock: it only bumps a
+        counter that due() and sleep() read.
+        """
+        def handler(*_):
+            self._signals += 1
+
+        signal.signal(signum, handler)
+
+    def serve_triggers(self, port: int, host: str = "127.0.0.1"):
+        """
+        Accept trigger requests on a localhost TCP port (see send_trigger):
+        one line of space-separated course IDs, or an empty line for all.
+        A line naming an unknown course is rejected as a whole.
+        """
+        scheduler = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                course_ids = self.rfile.readline().decode().split()
+                unknown = [c for c in course_ids if c not in scheduler.courses]
+                if unknown:
+                    logger.warning(f"⚠️ Trigger rejected, unknown course(s): {', '.join(unknown)}")
+                    self.wfile.write(f"error: unknown course(s) {' '.join(unknown)}\n".encode())
+                    return
+                scheduler.trigger(course_ids)
+                self.wfile.write(b"ok\n")
+
+        server = socketserver.ThreadingTCPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True, name="trigger").start()
+        logger.info(f"👂 Listening for triggers on {host}:{port}")
+        return server
+
+
+def send_trigger(port: int, course_ids=(), host: str = "127.0.0.1"):
+    """Ask a running Scheduler for an immediate cycle."""
+    with socket.create_connection((host, port), timeout=5) as conn:
+        conn.sendall((" ".join(course_ids) + "\n").encode())
+        print(conn.makefile().readline().strip())
@@ -0,0 +1,170 @@
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict
+
+from CalendarEvent import CalendarEvent, TZ, to_epoch
+
+logger = logging.getLogger(__name__)
+
+MIN_OCCURRENCES = 3   # shorter runs stay individual events
+MAX_GAP_RATIO = 0.5   # collapse only if skipped weeks ≤ this share of the occurrences
+WEEK = timedelta(days=7)
+
+
+def _series_key(event: CalendarEvent, start: datetime, end: datetime) -> tuple:
+    """Everything that must match for two events to be instances of one weekly series."""
+    return (
+        event.course_id, event.course, event.execution_type, event.location,
+        event.lecturers, event.groups, event.note,
+        start.weekday(), start.time(), end - start,
+    )
+
+
+def series_uid(key: tuple) -> str:
+    """Stable uid for a series: the same slot keeps its uid while weeks come and go."""
+    return "series_" + hashlib.sha256(repr(key).encode()).hexdigest()[:24]
+
+
+def _ical_local(dt: datetime) -> str:
+    return dt.strftime("%Y%m%dT%H%M%S")
+
+
+def _ical_utc(dt: datetime) -> str:
+    return dt.replace(tzinfo=TZ).astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def recurrence_lines(starts: list[datetime]) -> list[str]:
+    """RRULE (weekly, until the last start) plus an EXDATE for every skipped week."""
+    present = set(starts)
+    skipped = []
+    week = starts[0]
+    while week < starts[-1]:
+        week += WEEK
+        if week not in present:
+            skipped.append(week)
+    lines = [f"RRULE:FREQ=WEEKLY;UNTIL={_ical_utc(starts[-1])}"]
+    if skipped:
+        lines.append(f"EXDATE;TZID={TZ.key}:" + ",".join(_ical_local(dt) for dt in skipped))
+    return lines
+
+
+def occurrence_starts(start_time: str, recurrence: str) -> list[datetime]:
+    """The naive local starts that recurrence_lines() described for a series starting at start_time."""
+    week = datetime.fromisoformat(start_time)
+    until, skipped = week, set()
+    for line in recurrence.split("\n"):
+        if line.startswith("RRULE:"):
+            rule = dict(part.split("=", 1) for part in line.removeprefix("RRULE:").split(";"))
+            until = datetime.strptime(rule["UNTIL"], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+            until = until.astimezone(TZ).replace(tzinfo=None)
+        elif line.startswith("EXDATE"):
+            skipped = {datetime.strptime(value, "%Y%m%dT%H%M%S") for value in line.split(":", 1)[1].split(",")}
+    starts = []
+    while week <= until:
+        if week not in skipped:
+            starts.append(week)
+        week += WEEK
+    return starts
+
+
+def last_end_ts(start_time: str, end_time: str, recurrence: str | None) -> int:
+    """Epoch end of an event's last occurrence: its own end, or that of a series' last week."""
+    if not recurrence:
+        return to_epoch(end_time)
+    last = occurrence_starts(start_time, recurrence)[-1]
+    return to_epoch((last + (datetime.fromisoformat(end_time) - datetime.fromisoformat(start_time))).isoformat())
+
+
+def with_history(fresh: CalendarEvent | None, stored: CalendarEvent, cutoff: datetime) -> CalendarEvent | None:
+    """
+    A rolling fetch window only returns a series' occurrences from the window
+    start (`cutoff`) on, so collapse_series starts it there. Put the stored
+    series' occurrences before the cutoff back in front of the `fresh` one
+    (None: the series is gone from the fresh data, keep only its history), so
+    a moving window leaves the weeks that already happened in Google alone.
+    With nothing of the stored series before the cutoff, `fresh` is returned as is.
+    """
+    base = fresh or stored
+    starts = [start for start in occurrence_starts(stored.start_time, stored.recurrence) if start < cutoff]
+    if not starts:
+        return fresh
+    if fresh is not None:
+        starts += [start for start in occurrence_starts(fresh.start_time, fresh.recurrence) if start >= cutoff]
+    first = starts[0]
+    duration = datetime.fromisoformat(base.end_time) - datetime.fromisoformat(base.start_time)
+    return CalendarEvent(
+        uid=base.uid,
+        course_id=base.course_id,
+        course=base.course,
+        execution_type=base.execution_type,
+        start_time=first.isoformat(),
+        end_time=(first + duration).isoformat(),
+        location=base.location,
+        lecturers=base.lecturers,
+        groups=base.groups,
+        note=base.note,
+        recurrence="\n".join(recurrence_lines(starts)),
+    )
+
+
+def collapse_series(events) -> list[CalendarEvent]:
+    """
+    Replace each weekly series (same course, type, room, lecturers, groups, note,
+    weekday and time) with one recurring CalendarEvent: the first occurrence
+    plus RRULE/EXDATE lines in `recurrence`, and a series_uid as its uid.
+
+    An occurrence that deviates (moved room, other time, ...) no longer shares
+    the series key, so it stays an individual event and its week becomes an
+    EXDATE in the series. Google then shows the deviation in place of the
+    instance, without per-instance overrides that depend on Google's instance IDs.
+
+    Runs with fewer than MIN_OCCURRENCES, or more skipped weeks than
+    MAX_GAP_RATIO allows, are returned unchanged.
+    """
+    groups: dict[tuple, list] = defaultdict(list)
+    singles = []
+    for event in events:
+        try:
+            start = datetime.fromisoformat(event.start_time)
+            end = datetime.fromisoformat(event.end_time)
+        except (TypeError, ValueError):
+            singles.append(event)
+            continue
+        groups[_series_key(event, start, end)].append((start, event))
+
+    result = []
+    collapsed = series = 0
+    for key, occurrences in groups.items():
+        occurrences.sort(key=lambda pair: pair[0])
+        starts = [start for start, _ in occurrences]
+        # Same weekday and local time, so starts are whole weeks apart
+        weeks = (starts[-1] - starts[0]) // WEEK + 1
+        if (len(starts) < MIN_OCCURRENCES or len(set(starts)) != len(starts)
+                or weeks - len(starts) > MAX_GAP_RATIO * len(starts)):
+            result.extend(event for _, event in occurrences)
+            continue
+
+        first = occurrences[0][1]
+        result.append(CalendarEvent(
+            uid=series_uid(key),
+            course_id=first.course_id,
+            course=first.course,
+            execution_type=first.execution_type,
+            start_time=first.start_time,
+            end_time=first.end_time,
+            location=first.location,
+            lecturers=first.lecturers,
+            groups=first.groups,
+            note=first.note,
+            start_ts=first.start_ts,
+            end_ts=first.end_ts,
+            recurrence="\n".join(recurrence_lines(starts)),
+        ))
+        collapsed += len(starts)
+        series += 1
+
+    result.extend(singles)
+    if series:
+        logger.info(f"Collapsed {collapsed} events into {series} weekly series ({len(result)} events to sync).")
+    return result
@@ -0,0 +1,60 @@
+import logging
+
+from CalendarEvent import CalendarEvent
+from executor import WORKERS, RATE_PER_SECOND
+from ics import export_ics
+from sync_google import sync_to_google, reconcile_google, TOKEN_PATH
+
+logger = logging.getLogger(__name__)
+
+
+class Sink:
+    """
+    Where a cycle's DB diff goes. run_once calls push() when the diff found
+    changes, then reconcile() on every cycle to repair drift between the DB
+    and the sink. Both work on the current DB (see db.use_db).
+    """
+
+    name = "sink"
+
+    def push(self, created: list[CalendarEvent], updated: list[CalendarEvent]):
+        pass
+
+    def reconcile(self):
+        pass
+
+
+class GoogleSink(Sink):
+    """
+    A Google Calendar. Pass `service` to target any object with the Calendar v3
+    interface instead, e.g. fake_calendar.FakeCalendarService for load tests.
+    """
+
+    name = "google"
+
+    def __init__(
+        self,
+        calendar_id: str,
+        service=None,
+        token_path: str = TOKEN_PATH,
+        workers: int = WORKERS,
+        rate: float = RATE_PER_SECOND,
+    ):
+        self.calendar_id = calendar_id
+        self.options = {"service": service, "workers": workers, "rate": rate, "token_path": token_path}
+
+    def push(self, created, updated):
+        # The diff is already queued in the outbox by db.sync_events
+        sync_to_google(self.calendar_id, **self.options)
+
+    def reconcile(self):
+        reconcile_google(self.calendar_id, **self.options)
+
+
+class IcsSink(Sink):
+    """ics/<course_id>.ics files. Derived from the DB, so reconcile() re-renders whatever changed."""
+
+    name = "ics"
+
+    def reconcile(self):
+        export_ics()
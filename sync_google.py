@@ -1,10 +1,10 @@
 import os
+import json
 import time
+import hashlib
 import logging
-from datetime import datetime
+from functools import partial
 
-import pytz
-from dateutil import parser as date_parser
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -12,139 +12,432 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 from CalendarEvent import CalendarEvent
+from executor import SyncExecutor, WORKERS, RATE_PER_SECOND
 import db
+import metrics
 
 logger = logging.getLogger(__name__)
 
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
-TZ = pytz.timezone("Europe/Ljubljana")
-
-
-def _localize(dt_str: str):
-    dt = date_parser.parse(dt_str)
-    return dt if dt.tzinfo else TZ.localize(dt)
+TOKEN_PATH = "token.json"
+UID_PROPERTY = "tomUid"         # private extended property holding our uid on inserted events
+OUTBOX_CHUNK = 500              # outbox rows pushed per drain step
+OUTBOX_BACKOFF = 60.0           # seconds before retrying a failed op, doubled per attempt
+OUTBOX_BACKOFF_CAP = 6 * 60 * 60
 
 
 def _build_google_body(event: CalendarEvent) -> dict:
-    return {
+    body = {
         "summary": event.summary,
         "description": event.description,
         "location": event.location,
         "start": {
-            "dateTime": _localize(event.start_time).isoformat(),
+            "dateTime": event.start.isoformat(),
             "timeZone": "Europe/Ljubljana",
         },
         "end": {
-            "dateTime": _localize(event.end_time).isoformat(),
+            "dateTime": event.end.isoformat(),
             "timeZone": "Europe/Ljubljana",
         },
     }
+    if event.recurrence:
+        body["recurrence"] = event.recurrence.split("\n")
+    return body
 
 
-def _create_event(service, calendar_id: str, event: CalendarEvent):
-    try:
-        body = _build_google_body(event)
-        result = service.events().insert(calendarId=calendar_id, body=body).execute()
-        time.sleep(0.05)
-        db.update_google_id(event.uid, result["id"])
+def body_hash(body: dict) -> str:
+    """Stable hash of a Google event body, stored to skip no-op PATCHes."""
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+
+
+def _record_push(event: CalendarEvent, result: dict, body: dict) -> tuple:
+    """
+    Remember what Google now holds for this event (id, etag, body hash).
+    Returns the row for db.update_google_ids, so a whole batch is written at once.
+    """
+    event.google_id = result["id"]
+    event.google_etag = result.get("etag")
+    event.google_hash = body_hash(body)
+    return event.uid, event.google_id, event.google_etag, event.google_hash
+
+
+# Request builders: each returns a callable taking a service, so SyncExecutor
+# can build the request on the worker thread's own service object.
+
+def _insert_request(calendar_id: str, body: dict):
+    return lambda service: service.events().insert(calendarId=calendar_id, body=body)
+
+
+def _get_request(calendar_id: str, google_id: str):
+    return lambda service: service.events().get(calendarId=calendar_id, eventId=google_id)
+
+
+def _patch_request(calendar_id: str, google_id: str, body: dict, etag: str | None):
+    def build_request(service):
+        request = service.events().patch(calendarId=calendar_id, eventId=google_id, body=body)
+        if etag:
+            # Only overwrite the version we last pushed; 412 means someone edited it
+            request.headers["If-Match"] = etag
+        return request
+    return build_request
+
+
+def delete_request(calendar_id: str, google_id: str):
+    return lambda service: service.events().delete(calendarId=calendar_id, eventId=google_id)
+
+
+def _error_text(error: HttpError) -> str:
+    return f"{error.resp.status} {error.reason}"
+
+
+def _insert_body(event: CalendarEvent, body: dict) -> dict:
+    # Tag inserts with our uid so a replayed insert can find its first attempt (_find_inserted).
+    # Not part of body_hash: PATCHes never touch it.
+    return dict(body, extendedProperties={"private": {UID_PROPERTY: event.uid}})
+
+
+def _create_events(executor: SyncExecutor, calendar_id: str, events: list[CalendarEvent]) -> dict[str, str]:
+    """Insert events. Returns {uid: error} for the ones that failed."""
+    if not events:
+        return {}
+    by_uid = {e.uid: e for e in events}
+    bodies = {e.uid: _build_google_body(e) for e in events}
+    builders = [(uid, _insert_request(calendar_id, _insert_body(by_uid[uid], body))) for uid, body in bodies.items()]
+    pushed = []
+    failed = {}
+    for uid, (result, error) in executor.run_batch(builders).items():
+        event = by_uid[uid]
+        if error is not None:
+            logger.error(f"❌ Failed to create {uid}: {error}")
+            failed[uid] = _error_text(error)
+            continue
+        pushed.append(_record_push(event, result, bodies[uid]))
         logger.info(f"➕ Created: {event.summary} @ {event.start_time}")
-    except HttpError as e:
-        logger.error(f"❌ Failed to create {event.uid}: {e}")
+    db.update_google_ids(pushed)
+    return failed
 
 
-def _update_event(service, calendar_id: str, event: CalendarEvent):
-    try:
-        # Fetch existing Google event to patch it
-        google_event = service.events().get(
-            calendarId=calendar_id, eventId=event.google_id
-        ).execute()
-
-        new_body = _build_google_body(event)
-        changed = False
-
-        for field in ("summary", "description", "location"):
-            if google_event.get(field, "") != new_body.get(field, ""):
-                google_event[field] = new_body[field]
-                changed = True
-
-        new_start = new_body["start"]["dateTime"]
-        new_end = new_body["end"]["dateTime"]
-
-        if date_parser.parse(google_event["start"]["dateTime"]) != date_parser.parse(new_start):
-            google_event["start"]["dateTime"] = new_start
-            changed = True
-        if date_parser.parse(google_event["end"]["dateTime"]) != date_parser.parse(new_end):
-            google_event["end"]["dateTime"] = new_end
-            changed = True
-
-        if changed:
-            service.events().update(
-                calendarId=calendar_id, eventId=event.google_id, body=google_event
-            ).execute()
-            time.sleep(0.05)
+def _update_events(executor: SyncExecutor, calendar_id: str, events: list[CalendarEvent]) -> dict[str, str]:
+    """
+    PATCH events whose body differs from what we last pushed, guarded by If-Match.
+    Decided locally from events.google_hash; Google is only read back on a 412.
+    Returns {uid: error} for the ones that failed.
+    """
+    bodies = {}
+    for event in events:
+        body = _build_google_body(event)
+        if body_hash(body) == event.google_hash:
+            logger.debug(f"✅ No Google change needed: {event.uid}")
+        else:
+            bodies[event.uid] = body
+    if not bodies:
+        return {}
+    by_uid = {e.uid: e for e in events}
+
+    missing = []
+    conflicts = []
+    pushed = []
+    failed = {}
+    patches = [
+        (uid, _patch_request(calendar_id, by_uid[uid].google_id, body, by_uid[uid].google_etag))
+        for uid, body in bodies.items()
+    ]
+    for uid, (result, error) in executor.run_batch(patches).items():
+        event = by_uid[uid]
+        if error is None:
+            pushed.append(_record_push(event, result, bodies[uid]))
             logger.info(f"📝 Updated: {event.summary} @ {event.start_time}")
+        elif error.resp.status in (404, 410):
+            logger.warning(f"🟡 Event missing in Google, re-creating: {uid}")
+            missing.append(event)
+        elif error.resp.status == 412:
+            conflicts.append(event)
         else:
-            logger.debug(f"✅ No Google change needed: {event.uid}")
+            logger.error(f"❌ Failed to update {uid}: {error}")
+            failed[uid] = _error_text(error)
 
-    except HttpError as e:
-        if e.resp.status == 404:
-            logger.warning(f"🟡 Event missing in Google, re-creating: {event.uid}")
-            _create_event(service, calendar_id, event)
+    # Edited outside this app since our last push: read the current etag, then overwrite
+    gets = [(e.uid, _get_request(calendar_id, e.google_id)) for e in conflicts]
+    retries = []
+    for uid, (google_event, error) in executor.run_batch(gets).items():
+        event = by_uid[uid]
+        if error is None:
+            logger.warning(f"🟠 Event edited in Google, overwriting: {uid}")
+            retries.append((uid, _patch_request(calendar_id, event.google_id, bodies[uid], google_event.get("etag"))))
+        elif error.resp.status in (404, 410):
+            missing.append(event)
+        else:
+            logger.error(f"❌ Failed to update {uid}: {error}")
+            failed[uid] = _error_text(error)
+
+    for uid, (result, error) in executor.run_batch(retries).items():
+        event = by_uid[uid]
+        if error is None:
+            pushed.append(_record_push(event, result, bodies[uid]))
+            logger.info(f"📝 Updated: {event.summary} @ {event.start_time}")
         else:
-            logger.error(f"❌ Failed to update {event.uid}: {e}")
+            logger.error(f"❌ Failed to update {uid}: {error}")
+            failed[uid] = _error_text(error)
 
+    db.update_google_ids(pushed)
+    for event in missing:
+        event.google_id = None
+    failed.update(_create_events(executor, calendar_id, missing))
+    return failed
 
-def _delete_disabled(service, calendar_id: str):
-    """Delete Google Calendar events for events marked disabled in the DB."""
-    events = db.load_events_from_db()
+
+def _delete_events(executor: SyncExecutor, calendar_id: str, events: list[CalendarEvent]) -> dict[str, str]:
+    """Delete the Google copies of disabled events. Returns {uid: error} for the ones that failed."""
+    builders = [(e.uid, delete_request(calendar_id, e.google_id)) for e in events]
+    deleted = []
+    failed = {}
+    for uid, (_, error) in executor.run_batch(builders).items():
+        if error is not None and error.resp.status not in (404, 410):
+            logger.warning(f"⚠️ Failed to delete {uid}: {error}")
+            failed[uid] = _error_text(error)
+            continue
+        deleted.append((uid, None, None, None))
+        logger.info(f"🗑️ Deleted disabled event: {uid}")
+    db.update_google_ids(deleted)
+    return failed
+
+
+def _find_inserted(executor: SyncExecutor, calendar_id: str, events: list[CalendarEvent]) -> list[CalendarEvent]:
+    """
+    For inserts that were attempted before (maybe the process died before
+    recording the result), look the event up by its uid tag and adopt it
+    instead of inserting a duplicate. Returns the events that were not found.
+    """
+    builders = [
+        (e.uid, lambda service, uid=e.uid: service.events().list(
+            calendarId=calendar_id, privateExtendedProperty=f"{UID_PROPERTY}={uid}", maxResults=1,
+        ))
+        for e in events
+    ]
+    results = executor.run_batch(builders)
+    adopted = []
+    not_found = []
     for event in events:
-        if event.disabled and event.google_id:
-            try:
-                service.events().delete(
-                    calendarId=calendar_id, eventId=event.google_id
-                ).execute()
-                time.sleep(0.05)
-                db.update_google_id(event.uid, None)
-                logger.info(f"🗑️ Deleted disabled event: {event.uid}")
-            except HttpError as e:
-                logger.warning(f"⚠️ Failed to delete {event.uid}: {e}")
+        response, error = results[event.uid]
+        items = (response or {}).get("items") or []
+        if error is None and items:
+            # Unknown content: adopt id and etag, leave the hash empty so the drain patches it
+            event.google_id, event.google_etag, event.google_hash = items[0]["id"], items[0].get("etag"), None
+            adopted.append((event.uid, event.google_id, event.google_etag, None))
+            logger.info(f"♻️ Adopted earlier insert: {event.uid}")
+        else:
+            not_found.append(event)
+    db.update_google_ids(adopted)
+    return not_found
+
+
+def _drain_chunk(executor: SyncExecutor, calendar_id: str, rows: list[tuple]) -> tuple[int, int]:
+    """Push one chunk of outbox rows. Returns (done, failed)."""
+    events = db.events_by_uid([uid for uid, *_ in rows])
+    deletes, inserts, replays, patches = [], [], [], []
+    for uid, _, attempts, _ in rows:
+        event = events.get(uid)
+        if event is None:
+            continue
+        if event.disabled:
+            if event.google_id:
+                deletes.append(event)
+        elif not event.google_id:
+            (replays if attempts else inserts).append(event)
+        else:
+            patches.append(event)
+
+    db.outbox_started([e.uid for e in deletes + inserts + replays + patches])
+    failed = _delete_events(executor, calendar_id, deletes)
+    for event in _find_inserted(executor, calendar_id, replays):
+        inserts.append(event)
+    patches.extend(e for e in replays if e.google_id)
+    failed.update(_create_events(executor, calendar_id, inserts))
+    failed.update(_update_events(executor, calendar_id, patches))
+
+    now = time.time()
+    attempts = {uid: attempts for uid, _, attempts, _ in rows}
+    versions = {uid: version for uid, _, _, version in rows}
+    db.outbox_failed([
+        (uid, versions[uid], error, now + min(OUTBOX_BACKOFF_CAP, OUTBOX_BACKOFF * 2 ** attempts[uid]))
+        for uid, error in failed.items()
+    ])
+    db.outbox_done([(uid, version) for uid, _, _, version in rows if uid not in failed])
+    return len(rows) - len(failed), len(failed)
 
 
-def _get_service():
+def drain_outbox(executor: SyncExecutor, calendar_id: str) -> tuple[int, int]:
+    """
+    Push every due outbox row to Google, OUTBOX_CHUNK at a time, as fast as the
+    executor's rate allows. Rows that fail are retried on later drains with
+    exponential backoff. Replays are idempotent: each op is decided from the
+    event's current state, and a repeated insert first looks for its earlier copy.
+    Returns (done, failed).
+    """
+    done = failed = 0
+    while rows := db.outbox_due(OUTBOX_CHUNK):
+        d, f = _drain_chunk(executor, calendar_id, rows)
+        done += d
+        failed += f  # failed rows are rescheduled into the future, so this terminates
+    depth = db.outbox_depth()
+    metrics.inc("tom_outbox_ops_total", done, result="done")
+    metrics.inc("tom_outbox_ops_total", failed, result="failed")
+    metrics.set_gauge("tom_outbox_depth", sum(depth.values()), db=db.current_path())
+    if done or failed or depth:
+        logger.info(f"📬 Outbox: {done} pushed, {failed} failed, {sum(depth.values())} queued {depth or ''}")
+    return done, failed
+
+
+def get_credentials(token_path: str = TOKEN_PATH) -> Credentials:
+    """Credentials from token_path, refreshed (or from the OAuth flow if missing or dead) and saved back."""
     creds = None
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+    if os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
             flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
             creds = flow.run_local_server(port=0)
-        with open("token.json", "w") as f:
+        with open(token_path, "w") as f:
             f.write(creds.to_json())
-    return build("calendar", "v3", credentials=creds)
+    return creds
+
+
+def get_service(token_path: str = TOKEN_PATH):
+    """An authorised Calendar v3 service; runs the OAuth flow if token_path is missing or dead."""
+    return build("calendar", "v3", credentials=get_credentials(token_path))
 
 
-def sync_to_google(calendar_id: str, created: list[CalendarEvent], updated: list[CalendarEvent]):
-    """Push only the changed events to Google Calendar."""
-    if not created and not updated:
-        logger.info("No changes to push to Google Calendar.")
-        return
+def service_factory(service=None, token_path: str = TOKEN_PATH):
+    """
+    Service factory for SyncExecutor: `service` itself if given (e.g. fake_calendar),
+    else a new Calendar service per call. The credentials are loaded (and refreshed,
+    or the OAuth flow run) once, here on the calling thread, and shared by the
+    workers' services rather than each worker reading and rewriting token_path.
+    """
+    if service is not None:
+        return lambda: service
+    return partial(build, "calendar", "v3", credentials=get_credentials(token_path))
 
+
+def sync_to_google(
+    calendar_id: str,
+    service=None,
+    workers: int = WORKERS,
+    rate: float = RATE_PER_SECOND,
+    token_path: str = TOKEN_PATH,
+):
+    """
+    Push everything queued in the outbox (creates, updates and deletes recorded
+    by db.sync_events, plus earlier failures that are due) to Google Calendar.
+    Requests run on `workers` threads sharing a `rate` requests/second limit.
+    Pass `service` to target something other than the real API (e.g. fake_calendar),
+    or `token_path` to act as another Google account.
+    """
     try:
-        service = _get_service()
-        _delete_disabled(service, calendar_id)
+        with SyncExecutor(service_factory(service, token_path), workers=workers, rate=rate) as executor:
+            done, failed = drain_outbox(executor, calendar_id)
+        logger.info(f"Google sync done: {done} pushed, {failed} to retry.")
 
-        for event in created:
-            _create_event(service, calendar_id, event)
+    except HttpError as e:
+        logger.error(f"Google Calendar error: {e}")
 
-        for event in updated:
-            if event.google_id:
-                _update_event(service, calendar_id, event)
-            else:
-                _create_event(service, calendar_id, event)
 
-        logger.info(f"Google sync done: {len(created)} created, {len(updated)} updated.")
+def _list_changes(executor: SyncExecutor, calendar_id: str, sync_token: str | None) -> tuple[list[dict], str]:
+    """
+    Page through events().list. With a sync_token only events changed since that
+    token come back (deletions as status=cancelled); without one, every event.
+    Returns (items, next_sync_token). Raises HttpError 410 if the token expired.
+    """
+    items = []
+    page_token = None
+    while True:
+        response = executor.call(lambda service: service.events().list(
+            calendarId=calendar_id,
+            maxResults=2500,
+            showDeleted=True,
+            syncToken=sync_token,
+            pageToken=page_token,
+        ))
+        items.extend(response.get("items", []))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return items, response.get("nextSyncToken")
+
+
+def reconcile_google(
+    calendar_id: str,
+    service=None,
+    workers: int = WORKERS,
+    rate: float = RATE_PER_SECOND,
+    token_path: str = TOKEN_PATH,
+):
+    """
+    Repair drift between the DB and Google Calendar (manual edits or deletions).
+    Uses a stored syncToken so only remote changes since the last cycle are read;
+    falls back to a full list scan on the first run or when the token expired (410).
+    """
+    token_key = f"sync_token:{calendar_id}"
+    sync_token = db.get_meta(token_key)
+
+    try:
+        with SyncExecutor(service_factory(service, token_path), workers=workers, rate=rate) as executor:
+            try:
+                items, next_token = _list_changes(executor, calendar_id, sync_token)
+            except HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                logger.warning("🔄 Google syncToken expired, doing a full scan.")
+                sync_token = None
+                items, next_token = _list_changes(executor, calendar_id, None)
+
+            # A full scan needs every live event to find those that vanished; a delta only its own
+            by_google_id = db.live_events_by_google_id(None if sync_token is None else [item["id"] for item in items])
+            missing = []
+            drifted = []
+            learned = []  # synced before etags were stored: nothing to compare against yet
+            seen = set()
+
+            for item in items:
+                event = by_google_id.get(item["id"])
+                if event is None:
+                    continue  # not ours, or already disabled/deleted by us
+                seen.add(item["id"])
+                if item.get("status") == "cancelled":
+                    missing.append(event)
+                elif event.google_etag is None:
+                    event.google_etag = item.get("etag")
+                    learned.append(event)
+                elif item.get("etag") != event.google_etag:
+                    # Changed by someone else: overwrite with our version
+                    event.google_etag = item.get("etag")
+                    event.google_hash = None
+                    drifted.append(event)
+
+            if sync_token is None:
+                # A full scan also reveals events that vanished without a trace
+                missing.extend(e for gid, e in by_google_id.items() if gid not in seen)
+
+            for event in missing:
+                logger.warning(f"🟡 Event deleted in Google, re-creating: {event.uid}")
+            for event in drifted:
+                logger.warning(f"🟠 Event edited in Google, restoring: {event.uid}")
+            db.update_google_ids(
+                [(e.uid, None, None, None) for e in missing]
+                + [(e.uid, e.google_id, e.google_etag, None) for e in drifted]
+                + [(e.uid, e.google_id, e.google_etag, e.google_hash) for e in learned]
+            )
+            # Repairs go through the outbox too, along with any earlier failures now due
+            db.enqueue([(e.uid, "upsert") for e in missing + drifted])
+            drain_outbox(executor, calendar_id)
+
+            # Our own repairs show up in the next delta with matching etags
+            db.set_meta(token_key, next_token)
+
+        scan = "full scan" if sync_token is None else "incremental"
+        logger.info(f"Reconcile done ({scan}, {len(items)} remote changes): "
+                    f"{len(missing)} re-created, {len(drifted)} restored.")
 
     except HttpError as e:
         logger.error(f"Google Calendar error: {e}")
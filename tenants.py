@@ -0,0 +1,217 @@
+import json
+import hashlib
+import logging
+import threading
+from functools import partial
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import metrics
+from fetch import Fetched, fetch_courses, window_bounds, archive_cutoff
+from parse import decode_schedule, filter_decoded, filter_signature
+from sinks import GoogleSink
+from sync_google import get_credentials
+
+logger = logging.getLogger(__name__)
+
+TENANTS_FILE = "tenants.json"
+TENANT_WORKERS = 4  # tenants diffed and pushed to Google at the same time
+
+# tenants.json is a list of objects:
+#   {
+#     "name": "ana",
+#     "calendar_id": "...@group.calendar.google.com",
+#     "courses": {"811": "UMETNA INTELIGENCA", "1025": "SOCIOLOSKI IN POKLICNI VIDIKI"},
+#     "group_filter": {"1025": ["RV1"]},     # optional, same format as parse.GROUP_FILTER
+#     "token_path": "tokens/ana.json",       # optional, default token-<name>.json
+#     "db_path": "tenants/ana.db",           # optional, default calendar-<name>.db
+#     "collapse_series": true,               # optional, see main.COLLAPSE_SERIES
+#     "archive_history": false               # optional (default true), see main.ARCHIVE_HISTORY
+#   }
+
+
+class Tenant(NamedTuple):
+    name: str
+    calendar_id: str
+    courses: dict[str, str]
+    group_filter: dict[str, list[str] | dict]
+    token_path: str
+    db_path: str
+    collapse_series: bool = False
+    archive_history: bool = True
+
+
+def _group_filter(where: str, group_filter: dict[str, list[str] | dict]) -> dict[str, list[str] | dict]:
+    """
+    group_filter with "ids"/"exclude_ids" as ints, the type of Wise group ids:
+    "123" written as a string would otherwise never match. Raises ValueError
+    for values that are not whole numbers.
+    """
+    normalised = {}
+    for course_id, rules in group_filter.items():
+        if isinstance(rules, dict):
+            rules = dict(rules)
+            for key in ("ids", "exclude_ids"):
+                if key not in rules:
+                    continue
+                ids = []
+                for value in rules[key]:
+                    if isinstance(value, bool) or not (isinstance(value, int) or str(value).strip().isdigit()):
+                        raise ValueError(f"{where}: group_filter[{course_id!r}].{key}: {value!r} is not a group id")
+                    ids.append(int(value))
+                rules[key] = ids
+        normalised[course_id] = rules
+    return normalised
+
+
+def load_tenants(path: str = TENANTS_FILE) -> list[Tenant]:
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    tenants = [
+        Tenant(
+            name=t["name"],
+            calendar_id=t["calendar_id"],
+            courses={str(cid): name for cid, name in t["courses"].items()},
+            group_filter=_group_filter(f"{path}: tenant {t['name']}", t.get("group_filter", {})),
+            token_path=t.get("token_path", f"token-{t['name']}.json"),
+            db_path=t.get("db_path", f"calendar-{t['name']}.db"),
+            collapse_series=t.get("collapse_series", False),
+            archive_history=t.get("archive_history", True),
+        )
+        for t in config
+    ]
+    if len({t.db_path for t in tenants}) != len(tenants):
+        raise ValueError(f"{path}: every tenant needs its own db_path")
+    return tenants
+
+
+def all_courses(tenants: list[Tenant]) -> dict[str, str]:
+    """Union of every tenant's courses: what gets fetched once per cycle."""
+    courses = {}
+    for tenant in tenants:
+        courses.update(tenant.courses)
+    return courses
+
+
+class SharedCourses:
+    """
+    Course bodies fetched once per cycle and shared by every tenant. A body is
+    hashed once and decoded at most once, by the first tenant whose manifest
+    says it changed; tenants with the course unchanged never pay for decoding.
+    """
+
+    def __init__(self, fetched: dict[str, Fetched]):
+        self.bodies = {cid: f.body for cid, f in fetched.items() if f.body is not None}
+        self.digests = {cid: hashlib.sha256(body).hexdigest() for cid, body in self.bodies.items()}
+        self._decoded = {}
+        self._locks = {cid: threading.Lock() for cid in self.bodies}
+
+    def manifest_entry(self, course_id: str, group_filter: dict[str, list[str] | dict]) -> tuple:
+        """Same shape as parse.bytes_manifest_entry, with the tenant's filter signature."""
+        body = self.bodies[course_id]
+        return len(body), None, self.digests[course_id], filter_signature(course_id, group_filter)
+
+    def decoded(self, course_id: str) -> list[tuple[dict, tuple]]:
+        with self._locks[course_id]:
+            if course_id not in self._decoded:
+                self._decoded[course_id] = decode_schedule(self.bodies[course_id])
+            return self._decoded[course_id]
+
+
+def _diff_tenant(tenant: Tenant, shared: SharedCourses):
+    """Diff the tenant's subscribed courses into its DB. Returns the db.sync_courses tuple."""
+    manifest = db.get_manifest()
+
+    def parsed():
+        for course_id in tenant.courses:
+            if course_id not in shared.bodies:
+                continue  # not due this cycle, not modified, or the fetch failed
+            entry = shared.manifest_entry(course_id, tenant.group_filter)
+            old = manifest.get(course_id)
+            if old and old[2:] == entry[2:]:
+                continue
+            try:
+                events = filter_decoded(course_id, shared.decoded(course_id), tenant.group_filter)
+            except Exception as e:
+                yield course_id, None, e, None
+                continue
+            yield course_id, events, None, partial(db.update_manifest, course_id, entry)
+
+    return db.sync_courses(parsed(), tenant.courses, window_bounds(), tenant.collapse_series, f"[{tenant.name}] ")
+
+
+def sync_tenant(tenant: Tenant, shared: SharedCourses, service=None) -> set[str]:
+    """Diff and push one tenant, inside its own DB. Returns the IDs of its changed courses."""
+    with db.use_db(tenant.db_path):
+        db.init_db()
+        empty_before = db.is_empty()
+        created, updated, disabled, changed_courses = _diff_tenant(tenant, shared)
+        sink = GoogleSink(tenant.calendar_id, service=service, token_path=tenant.token_path)
+
+        if empty_before or created or updated or disabled:
+            logger.info(f"[{tenant.name}] Changes detected — syncing to Google Calendar...")
+            with metrics.stage(f"push:{sink.name}"):
+                sink.push(created, updated)
+        else:
+            logger.info(f"[{tenant.name}] No changes — nothing to push to Google Calendar.")
+
+        with metrics.stage(f"reconcile:{sink.name}"):
+            sink.reconcile()
+        if tenant.archive_history:
+            db.archive_events(archive_cutoff())
+    return changed_courses
+
+
+def run_tenants(
+    tenants: list[Tenant], courses: dict[str, str] | None = None, service=None
+) -> tuple[set[str], set[str]] | None:
+    """
+    One multi-tenant cycle: fetch every course any tenant follows (or just
+    `courses`) once, then diff and push all tenants in parallel, each in its own
+    DB and with its own Google token. API and parse cost scale with unique courses.
+
+    Fetches are unconditional: the HTTP validators live in each tenant's DB, and
+    a 304 is only useful if every subscriber already holds the body. Unchanged
+    courses are still skipped per tenant by digest before any parsing.
+    Returns (changed, failed): the union of changed course IDs and the courses
+    that could not be fetched; or None if the fetch failed altogether.
+    """
+    courses = all_courses(tenants) if courses is None else courses
+    with metrics.cycle():
+        result = _run_tenants(tenants, courses, service)
+    if result is None or result[1]:
+        metrics.inc("tom_fetch_failures_total")
+    return result
+
+
+def load_credentials(tenants: list[Tenant]):
+    """
+    Load every tenant's Google token in turn (refreshing it, or running the
+    OAuth flow), so the tenant threads find them valid and never prompt at once.
+    """
+    for tenant in tenants:
+        get_credentials(tenant.token_path)
+
+
+def _run_tenants(tenants: list[Tenant], courses: dict[str, str], service) -> tuple[set[str], set[str]] | None:
+    with metrics.stage("fetch"):
+        fetched = fetch_courses(courses)
+    if not fetched:
+        return None
+    shared = SharedCourses(fetched)
+    if service is None:
+        load_credentials(tenants)
+
+    def _run(tenant):
+        try:
+            return sync_tenant(tenant, shared, service=service)
+        except Exception as e:
+            logger.error(f"[{tenant.name}] Tenant sync failed: {e}", exc_info=True)
+            return set()
+
+    with ThreadPoolExecutor(max_workers=TENANT_WORKERS, thread_name_prefix="tenant") as pool:
+        results = list(pool.map(metrics.in_cycle(_run), tenants))
+
+    logger.info(f"✅ {len(tenants)} tenants synced from {len(shared.bodies)} course downloads.")
+    return set().union(*results), set(courses) - set(fetched)